@@ -1,12 +1,35 @@
+import asyncio
+import math
 import os
+from collections.abc import AsyncIterator
 
-from sqlmodel import Session, select
-from taskiq import InMemoryBroker
+from sqlalchemy import case, literal
+from sqlmodel import delete, func, select, update
+from sqlmodel.ext.asyncio.session import AsyncSession
+from taskiq import (
+    Context,
+    InMemoryBroker,
+    SimpleRetryMiddleware,
+    TaskiqDepends,
+    TaskiqEvents,
+    TaskiqState,
+)
 from taskiq_aio_pika import AioPikaBroker
 
-from app.dependencies import engine
-from app.models.upload import Upload, UploadEntry, UploadStatus
-from app.services.sentiment_predict import SentimentPredict
+from app.dependencies import async_engine
+from app.models.upload import Upload, UploadEntry, UploadEntryChunk, UploadStatus
+from app.services.metrics import (
+    TaskMetricsMiddleware,
+    start_worker_metrics_server,
+    upload_entries,
+    upload_entries_processed,
+)
+from app.services.pipeline import run_pipeline
+from app.services.prediction_cache import CachedSentimentPredict, prediction_cache
+from app.services.progress import load_progress, progress_channel
+from app.services.scheduling import max_priority, task_priority
+from app.services.sentiment_predict import SentimentPredict, max_length
+from app.services.summary import count_sentiments
 from app.settings import settings
 
 env = os.environ.get("ENVIRONMENT")
@@ -15,33 +38,441 @@ broker = AioPikaBroker(
     settings.rabbit_mq_url,
     exchange_name=settings.rabbit_queue,
     queue_name=settings.rabbit_queue,
+    # the queue has to be recreated when the number of lanes changes
+    max_priority=max_priority or None,
 )
 
 if env and env == "pytest":
     print("12312312312")
     broker = InMemoryBroker()
 
+# failed uploads are retried and resume from their last committed batch
+broker.add_middlewares(
+    SimpleRetryMiddleware(default_retry_count=settings.upload_max_retries),
+    TaskMetricsMiddleware(),
+)
 
-predictor = SentimentPredict()
+predictor = CachedSentimentPredict(SentimentPredict(), prediction_cache)
 
 
-@broker.task
-async def process_upload(upload_id: int):
-    print(f"Processing upload {upload_id}")
+@broker.on_event(TaskiqEvents.WORKER_STARTUP)
+async def warm_up_model(_: TaskiqState):
+    if settings.predict_warmup:
+        await asyncio.to_thread(predictor.predictor.warm_up)
+
+
+@broker.on_event(TaskiqEvents.WORKER_STARTUP)
+async def serve_metrics(_: TaskiqState):
+    if settings.worker_metrics_port:
+        start_worker_metrics_server(settings.worker_metrics_port)
+
+
+@broker.on_event(TaskiqEvents.WORKER_SHUTDOWN)
+async def close_database(_: TaskiqState):
+    await async_engine.dispose()
+
+
+def is_long_document(text: str) -> bool:
+    # a text shorter than the model window (minus the special tokens) in
+    # characters can't exceed it in tokens
+    return settings.long_document_mode and len(text) > max_length - 2
+
+
+def original_spans(text: str, spans: list[tuple[int, int]]) -> list[tuple[int, int]]:
+    """
+    Maps [start, end) spans of the ASCII-only text the model scored back to
+    positions in the original `text`.
+    """
+    kept = [i for i, char in enumerate(text) if ord(char) < 128]
+    result = []
+    for start, end in spans:
+        if end <= start:
+            position = kept[start] if start < len(kept) else len(text)
+            result.append((position, position))
+        else:
+            result.append((kept[start], kept[end - 1] + 1))
+    return result
+
+
+class ScoringBatch:
+    """A batch of entries on its way through the scoring pipeline."""
+
+    def __init__(self, entries: list[UploadEntry]):
+        self.entries = entries
+        # remove russian (cyrilic) and grbage symbols
+        self.texts = ["".join(filter(lambda x: ord(x) < 128, entry.text)) for entry in entries]
+        self.short = [i for i, text in enumerate(self.texts) if not is_long_document(text)]
+        self.long = [i for i, text in enumerate(self.texts) if is_long_document(text)]
+        self.prepared = None
+        self.documents = []
+
+
+async def fetch_batches(
+    upload_id: int, start_id: int, end_id: int
+) -> AsyncIterator[ScoringBatch]:
+    """Unscored entries of `upload_id` with ids in [start_id, end_id), in batches."""
+    while start_id < end_id:
+        # the session is closed before the batch is handed on, so no read
+        # transaction stays open while the batch waits in the pipeline
+        async with AsyncSession(async_engine) as session:
+            entries = (
+                await session.exec(
+                    select(UploadEntry)
+                    .where(UploadEntry.upload_id == upload_id)
+                    .where(UploadEntry.id >= start_id)
+                    .where(UploadEntry.id < end_id)
+                    .where(UploadEntry.sentiment.is_(None))
+                    .order_by(UploadEntry.id)
+                    .limit(settings.process_batch_size)
+                )
+            ).all()
+        if not entries:
+            return
+
+        start_id = entries[-1].id + 1
+        yield ScoringBatch(list(entries))
+
+
+def prepare_batch(batch: ScoringBatch) -> ScoringBatch:
+    batch.prepared = predictor.prepare_batch([batch.texts[i] for i in batch.short])
+    return batch
+
+
+def forward_batch(batch: ScoringBatch) -> ScoringBatch:
+    for i, sentiment in zip(batch.short, predictor.finish_batch(batch.prepared)):
+        batch.entries[i].sentiment = sentiment
+
+    if batch.long:
+        batch.documents = predictor.predictor.predict_documents(
+            [batch.texts[i] for i in batch.long]
+        )
+        for i, document in zip(batch.long, batch.documents):
+            batch.entries[i].sentiment = document.sentiment
+    return batch
+
+
+async def write_batch(upload_id: int, batch: ScoringBatch):
+    """
+    Stores the sentiments of a scored batch together with the upload's
+    progress counter and summary counts, so an interrupted run resumes
+    after the last written batch.
+
+    Only entries that are still unscored are written and counted, so a
+    batch scored twice, by a redelivered or overlapping task, doesn't
+    count twice.
+    """
+    async with AsyncSession(async_engine) as session:
+        sentiments = case(
+            {
+                entry.id: literal(entry.sentiment, UploadEntry.sentiment.type)
+                for entry in batch.entries
+            },
+            value=UploadEntry.id,
+        )
+        written = set(
+            (
+                await session.exec(
+                    update(UploadEntry)
+                    .where(UploadEntry.upload_id == upload_id)
+                    .where(UploadEntry.id.in_([entry.id for entry in batch.entries]))
+                    .where(UploadEntry.sentiment.is_(None))
+                    .values(sentiment=sentiments)
+                    .returning(UploadEntry.id)
+                )
+            ).scalars()
+        )
+        entries = [entry for entry in batch.entries if entry.id in written]
+        await predictor.store_batch(session, batch.prepared)
+        long = {i for i in batch.long if batch.entries[i].id in written}
+
+        if long:
+            await session.exec(
+                delete(UploadEntryChunk)
+                .where(UploadEntryChunk.upload_id == upload_id)
+                .where(UploadEntryChunk.entry_id.in_([batch.entries[i].id for i in long]))
+            )
+        for i, document in zip(batch.long, batch.documents):
+            if i not in long or len(document.chunks) < 2:
+                continue
+
+            # chunk offsets are stored as positions in the entry's own text
+            spans = original_spans(
+                batch.entries[i].text, [(chunk.start, chunk.end) for chunk in document.chunks]
+            )
+            for chunk_id, (chunk, (start, end)) in enumerate(zip(document.chunks, spans)):
+                session.add(
+                    UploadEntryChunk(
+                        upload_id=upload_id,
+                        entry_id=batch.entries[i].id,
+                        id=chunk_id,
+                        start=start,
+                        end=end,
+                        sentiment=chunk.sentiment,
+                    )
+                )
+
+        await count_sentiments(session, upload_id, entries)
+        await session.exec(
+            update(Upload)
+            .where(Upload.id == upload_id)
+            .values(entries_done=Upload.entries_done + len(entries))
+        )
+        await session.commit()
+    upload_entries_processed.inc(len(entries))
+    await publish_progress(upload_id)
+
+
+async def score_entry_range(upload_id: int, start_id: int, end_id: int):
+    """
+    Scores the entries of `upload_id` with ids in [start_id, end_id) that
+    have no sentiment yet.
 
-    with Session(engine) as session:
-        entries = session.exec(
-            select(UploadEntry).where(UploadEntry.upload_id == upload_id)
+    Fetching, tokenizing, the forward pass and writing back run as
+    pipeline stages, so the model works on one batch while the next one
+    is read and tokenized and the previous one is written. Tokenization
+    and inference run in threads and release the GIL, so the worker keeps
+    serving its other tasks. `settings.pipeline_depth` bounds the batches
+    waiting between two stages.
+    """
+    await run_pipeline(
+        fetch_batches(upload_id, start_id, end_id),
+        [
+            lambda batch: asyncio.to_thread(prepare_batch, batch),
+            lambda batch: asyncio.to_thread(forward_batch, batch),
+            lambda batch: write_batch(upload_id, batch),
+        ],
+        maxsize=settings.pipeline_depth,
+    )
+
+
+async def publish_progress(upload_id: int):
+    progress = await load_progress(async_engine, upload_id)
+    if progress is not None:
+        await progress_channel.publish(progress)
+
+
+def is_last_attempt(context: Context) -> bool:
+    # mirrors SimpleRetryMiddleware: a failure is final once the retries
+    # are used up
+    labels = context.message.labels
+    retry_on_error = str(labels.get("retry_on_error", False)).lower() == "true"
+    retries = int(labels.get("_retries", 0)) + 1
+    max_retries = int(labels.get("max_retries", settings.upload_max_retries))
+    return not retry_on_error or retries >= max_retries
+
+
+async def finish_upload(session: AsyncSession, upload_id: int, failed: bool = False):
+    """
+    Marks the upload ERROR after a final failure, or READY once every entry
+    is scored. Other outcomes leave it PROCESSING.
+    """
+    if failed:
+        await session.exec(
+            update(Upload).where(Upload.id == upload_id).values(status=UploadStatus.ERROR)
+        )
+        return
+
+    # entries may have been scored by earlier, interrupted runs, so the
+    # remaining ones are counted instead of trusting the progress counter
+    remaining = (
+        await session.exec(
+            select(func.count())
+            .where(UploadEntry.upload_id == upload_id)
+            .where(UploadEntry.sentiment.is_(None))
+        )
+    ).one()
+    if not remaining:
+        # only the run that flips the status counts the upload
+        finished = (
+            await session.exec(
+                update(Upload)
+                .where(Upload.id == upload_id)
+                .where(Upload.status != UploadStatus.READY)
+                .values(status=UploadStatus.READY)
+                .returning(Upload.entries_total)
+            )
+        ).first()
+        if finished is not None:
+            upload_entries.observe(finished.entries_total)
+
+
+async def finish_shard(upload_id: int, failed: bool, owner_id: str | None = None):
+    """
+    Counts a finished shard, updates the upload status and kicks the next
+    queued shards of the upload's owner.
+    """
+    async with AsyncSession(async_engine) as session:
+        counter = Upload.shards_failed if failed else Upload.shards_done
+        updated_owner_id = (
+            await session.exec(
+                update(Upload)
+                .where(Upload.id == upload_id)
+                .values({counter: counter + 1})
+                .returning(Upload.created_by_user_id)
+            )
+        ).scalar_one_or_none()
+        if updated_owner_id is not None:
+            await finish_upload(session, upload_id, failed)
+        await session.commit()
+
+    if updated_owner_id is None:
+        # the upload was deleted while the shard ran; its slot still frees up
+        # for the owner's other uploads
+        if owner_id is not None:
+            await kick_owner_shards(owner_id)
+        return
+
+    await publish_progress(upload_id)
+    await kick_owner_shards(updated_owner_id)
+
+
+async def kick_upload(upload_id: int, entries: int):
+    """Queues an upload in the priority lane of its size."""
+    await process_upload.kicker().with_labels(priority=task_priority(entries)).kiq(
+        upload_id=upload_id
+    )
+
+
+async def kick_owner_shards(owner_id: str):
+    """
+    Kicks the not yet queued shards of `owner_id`'s uploads, oldest upload
+    first, until the owner has `settings.owner_max_shards` shards queued or
+    running. Every finished shard calls this again, so one user's large
+    uploads never take more than that share of the workers.
+
+    Concurrent calls for one owner may both see a free slot, so the limit
+    can be exceeded by a shard or two; a shard itself is only ever kicked
+    once.
+    """
+    in_flight = Upload.shards_kicked - Upload.shards_done - Upload.shards_failed
+    owned = (Upload.created_by_user_id == owner_id) & (Upload.status == UploadStatus.PROCESSING)
+
+    kicks = []
+    async with AsyncSession(async_engine) as session:
+        running = (
+            await session.exec(select(func.coalesce(func.sum(in_flight), 0)).where(owned))
+        ).one()
+        free = (settings.owner_max_shards or math.inf) - running
+
+        uploads = (
+            await session.exec(
+                select(Upload.id, Upload.entries_total)
+                .where(owned)
+                .where(Upload.shards_kicked < Upload.shards_total)
+                .order_by(Upload.id)
+            )
         ).all()
+        for upload_id, entries_total in uploads:
+            if free <= 0:
+                break
+
+            first_id = (
+                await session.exec(
+                    select(func.min(UploadEntry.id)).where(UploadEntry.upload_id == upload_id)
+                )
+            ).one()
+            while free > 0:
+                kicked = (
+                    await session.exec(
+                        update(Upload)
+                        .where(Upload.id == upload_id)
+                        .where(Upload.shards_kicked < Upload.shards_total)
+                        .values(shards_kicked=Upload.shards_kicked + 1)
+                        .returning(Upload.shards_kicked)
+                    )
+                ).first()
+                if kicked is None:
+                    break
+
+                start_id = first_id + (kicked.shards_kicked - 1) * settings.upload_shard_size
+                kicks.append((upload_id, start_id, task_priority(entries_total)))
+                free -= 1
+        await session.commit()
+
+    for upload_id, start_id, priority in kicks:
+        await process_upload_shard.kicker().with_labels(priority=priority).kiq(
+            upload_id=upload_id,
+            start_id=start_id,
+            end_id=start_id + settings.upload_shard_size,
+            owner_id=owner_id,
+        )
+
+
+@broker.task(retry_on_error=True, max_retries=settings.upload_max_retries)
+async def process_upload(upload_id: int, context: Context = TaskiqDepends()):
+    print(f"Processing upload {upload_id}")
+
+    async with AsyncSession(async_engine) as session:
+        first_id, last_id, count, done = (
+            await session.exec(
+                select(
+                    func.min(UploadEntry.id),
+                    func.max(UploadEntry.id),
+                    func.count(),
+                    func.count(UploadEntry.sentiment),
+                ).where(UploadEntry.upload_id == upload_id)
+            )
+        ).one()
+
+        upload = await session.get(Upload, upload_id)
+        if upload is None:
+            print(f"Upload {upload_id} was deleted")
+            return
+
+        owner_id = upload.created_by_user_id
+        # a retry or redelivery after the upload was split keeps the shard
+        # counters, so only the shards not kicked yet are kicked below
+        shards_total = upload.shards_total
+        if not shards_total:
+            upload.status = UploadStatus.PROCESSING
+            upload.entries_total = count
+            upload.entries_done = done
+            if count > settings.upload_shard_size:
+                # shards are kicked as the owner's share of the workers allows
+                shards_total = math.ceil((last_id + 1 - first_id) / settings.upload_shard_size)
+                upload.shards_total = shards_total
+                upload.shards_kicked = 0
+                upload.shards_done = 0
+                upload.shards_failed = 0
+            await session.commit()
+    await publish_progress(upload_id)
+
+    if not shards_total:
+        failed = True
+        try:
+            if count:
+                await score_entry_range(upload_id, first_id, last_id + 1)
+            failed = False
+        finally:
+            if not failed or is_last_attempt(context):
+                async with AsyncSession(async_engine) as session:
+                    await finish_upload(session, upload_id, failed)
+                    await session.commit()
+                await publish_progress(upload_id)
+
+        print(f"Upload {upload_id} processed")
+        return
+
+    await kick_owner_shards(owner_id)
+
+    print(f"Upload {upload_id} split into {shards_total} shards")
 
-        for entry in entries:
-            text = entry.text
-            # remove russian (cyrilic) and grbage symbols
-            text = "".join(filter(lambda x: ord(x) < 128, text))
-            entry.sentiment = predictor.predict(text)
 
-        upload = session.get(Upload, upload_id)
-        upload.status = UploadStatus.READY
-        session.commit()
+@broker.task(retry_on_error=True, max_retries=settings.upload_max_retries)
+async def process_upload_shard(
+    upload_id: int,
+    start_id: int,
+    end_id: int,
+    owner_id: str | None = None,
+    context: Context = TaskiqDepends(),
+):
+    print(f"Processing upload {upload_id} entries {start_id}..{end_id - 1}")
 
-    print(f"Upload {upload_id} processed")
+    failed = True
+    try:
+        await score_entry_range(upload_id, start_id, end_id)
+        failed = False
+    finally:
+        # a failure that will be retried isn't counted yet
+        if not failed or is_last_attempt(context):
+            await finish_shard(upload_id, failed, owner_id)
@@ -1,19 +1,55 @@
+from collections.abc import AsyncIterator
 from typing import Annotated
 
 import jwt
 from fastapi import Depends, HTTPException
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import OpenIdConnect
-from sqlmodel import Session, SQLModel, create_engine, select
+from sqlalchemy import make_url
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlmodel import Session, create_engine, exists, or_, select
+from sqlmodel.ext.asyncio.session import AsyncSession
 
 from .models.keycloak import KeycloakIDToken
+from .models.prediction_cache import PredictionCacheEntry  # noqa: F401
 from .models.upload import Upload
 from .models.upload_access import AccessRecipientType, UploadAccess
 from .models.user import User
+from .services.auth import token_verifier
+from .services.cache import LRUCache
+from .services.schema import upgrade_schema
+from .services.sql import async_database_url, dialect_insert
+from .services.timing import phase
 from .settings import settings
 
-engine = create_engine(settings.database_url)
 
-SQLModel.metadata.create_all(engine)
+def pool_options(url: str) -> dict:
+    # SQLite gets SQLAlchemy's default pool for its driver
+    if make_url(url).get_backend_name() == "sqlite":
+        return {}
+    return {
+        "pool_size": settings.db_pool_size,
+        "max_overflow": settings.db_max_overflow,
+        "pool_timeout": settings.db_pool_timeout,
+        "pool_recycle": settings.db_pool_recycle,
+        "pool_pre_ping": True,
+    }
+
+
+engine = create_engine(settings.database_url, **pool_options(settings.database_url))
+
+# used by the async routes and the worker, so database round trips don't
+# block the event loop
+async_engine = create_async_engine(
+    settings.async_database_url or async_database_url(settings.database_url),
+    **pool_options(settings.database_url),
+)
+
+upgrade_schema(engine)
+
+
+user_cache = LRUCache(settings.user_cache_size)
+access_cache = LRUCache(settings.access_cache_size, ttl=settings.access_cache_ttl)
 
 
 def get_session() -> Session:  # type: ignore
@@ -21,6 +57,12 @@ def get_session() -> Session:  # type: ignore
         yield session
 
 
+async def get_async_session() -> AsyncIterator[AsyncSession]:
+    # objects stay readable after commit without another round trip
+    async with AsyncSession(async_engine, expire_on_commit=False) as session:
+        yield session
+
+
 oauth_2_scheme = OpenIdConnect(
     openIdConnectUrl=f"{settings.oidc_base_url}/.well-known/openid-configuration"
 )
@@ -29,10 +71,6 @@ oauth_2_scheme = OpenIdConnect(
 async def get_oidc_keycloak_user(
     access_token: Annotated[str, Depends(oauth_2_scheme)],
 ) -> KeycloakIDToken:
-    url = f"{settings.oidc_base_url}/protocol/openid-connect/certs"
-
-    optional_custom_headers = {"User-agent": "custom-user-agent"}
-
     splited = access_token.split(" ")
 
     if len(splited) != 2:
@@ -40,20 +78,14 @@ async def get_oidc_keycloak_user(
 
     token = splited[1]
 
-    jwks_client = jwt.PyJWKClient(url, headers=optional_custom_headers)
-
     try:
-        signing_key = jwks_client.get_signing_key_from_jwt(token)
-        data = jwt.decode(
-            token,
-            signing_key.key,
-            algorithms=["RS256"],
-            audience="profile",
-            options={"verify_exp": True, "verify_aud": False, "verify_at_hash": False},
-        )
-        return KeycloakIDToken.model_validate(data)
+        with phase("auth"):
+            # fetching the signing keys blocks, keep it off the event loop
+            return await run_in_threadpool(token_verifier.verify, token)
     except jwt.exceptions.InvalidTokenError as e:
         raise HTTPException(status_code=401, detail=f"Not authenticated: {e}")
+    except jwt.exceptions.PyJWKClientConnectionError:
+        raise HTTPException(status_code=503, detail="Identity provider unavailable")
 
 
 def get_user(
@@ -68,23 +100,59 @@ def get_user(
             )
         org = list(data.organization.keys())[0]
 
-    current_user = User(id=data.sub, email=data.email, organization=org)
-
-    db_user = session.get(User, data.sub)
-
-    if db_user is None:
-        session.add(current_user)
-        session.commit()
-        session.refresh(current_user)
-        return current_user
+    # the user row only has to be written when this process hasn't seen
+    # these claims yet
+    key = (data.sub, data.email, org)
+    user = user_cache.get(key)
+    if user is not None:
+        return user
+
+    statement = dialect_insert(session.get_bind(), User).values(
+        id=data.sub, email=data.email, organization=org
+    )
+    session.exec(
+        statement.on_conflict_do_update(
+            index_elements=[User.id],
+            set_={"email": data.email, "organization": org},
+            where=or_(
+                User.email != statement.excluded.email,
+                User.organization.is_distinct_from(statement.excluded.organization),
+            ),
+        )
+    )
+    session.commit()
+
+    user = User(id=data.sub, email=data.email, organization=org)
+    user_cache.set(key, user)
+    return user
+
+
+def can_access_upload(user: User):
+    """
+    SQL condition that is true for uploads `user` owns or that are shared
+    with the user or the user's organization.
+    """
+    grants = [
+        Upload.created_by_user_id == user.id,
+        exists().where(
+            UploadAccess.upload_id == Upload.id,
+            UploadAccess.recipient_type == AccessRecipientType.USER,
+            UploadAccess.recipient_id == user.id,
+        ),
+    ]
+    if user.organization:
+        grants.append(
+            exists().where(
+                UploadAccess.upload_id == Upload.id,
+                UploadAccess.recipient_type == AccessRecipientType.ORG,
+                UploadAccess.recipient_id == user.organization,
+            )
+        )
+    return or_(*grants)
 
-    if db_user != current_user:
-        db_user.email = current_user.email
-        db_user.organization = current_user.organization
-        session.commit()
-        session.refresh(db_user)
 
-    return db_user
+def invalidate_upload_access(upload_id: int):
+    access_cache.discard_where(lambda key: key[2] == upload_id)
 
 
 def get_upload_from_path(
@@ -92,30 +160,25 @@ def get_upload_from_path(
     user: User = Depends(get_user),
     session: Session = Depends(get_session),
 ) -> Upload:
-    upload = session.exec(select(Upload).where(Upload.id == upload_id)).first()
-    if not upload:
-        raise HTTPException(status_code=404, detail="Upload not found")
-
-    if upload.created_by_user_id == user.id:
-        return upload
-
-    access = session.exec(
-        select(UploadAccess)
-        .where(UploadAccess.upload_id == upload_id)
-        .where(UploadAccess.recipient_id == user.id)
-        .where(UploadAccess.recipient_type == AccessRecipientType.USER)
-    ).first()
-    if access:
-        return upload
+    key = (user.id, user.organization, upload_id)
+    allowed = access_cache.get(key)
 
-    if user.organization:
-        access = session.exec(
-            select(UploadAccess)
-            .where(UploadAccess.upload_id == upload_id)
-            .where(UploadAccess.recipient_id == user.organization)
-            .where(UploadAccess.recipient_type == AccessRecipientType.ORG)
+    if allowed is None:
+        row = session.exec(
+            select(Upload, can_access_upload(user)).where(Upload.id == upload_id)
         ).first()
-        if access:
-            return upload
+        if not row:
+            raise HTTPException(status_code=404, detail="Upload not found")
+
+        upload, allowed = row
+        access_cache.set(key, bool(allowed))
+    elif allowed:
+        upload = session.get(Upload, upload_id)
+        if not upload:
+            invalidate_upload_access(upload_id)
+            raise HTTPException(status_code=404, detail="Upload not found")
+
+    if not allowed:
+        raise HTTPException(status_code=403, detail="No access to upload")
 
-    raise HTTPException(status_code=403, detail="No access to upload")
+    return upload
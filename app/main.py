@@ -1,12 +1,20 @@
+import asyncio
 from contextlib import asynccontextmanager
 
 from fastapi import APIRouter, FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
 from .broker import broker
+from .dependencies import async_engine
+from .routes.check import predict as check_predict
 from .routes.check import router as check_router
+from .routes.check import scheduler as check_scheduler
+from .routes.metrics import router as metrics_router
 from .routes.uploads import router as upload_router
 from .routes.users import router as user_router
+from .services.metrics import MetricsMiddleware
+from .services.timing import ServerTimingMiddleware
+from .settings import settings
 
 
 @asynccontextmanager
@@ -14,8 +22,14 @@ async def lifespan(_: FastAPI):
     if not broker.is_worker_process:
         await broker.startup()
 
+    if settings.predict_warmup:
+        await asyncio.to_thread(check_predict.predictor.warm_up)
+
     yield
 
+    await check_scheduler.shutdown()
+    await async_engine.dispose()
+
     if not broker.is_worker_process:
         await broker.shutdown()
 
@@ -34,9 +48,15 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # the upload list's pagination cursor
+    expose_headers=["X-Next-Cursor"],
 )
 
 api_router.include_router(user_router)
 api_router.include_router(upload_router)
 api_router.include_router(check_router)
 app.include_router(api_router)
+app.include_router(metrics_router)
+
+app.add_middleware(MetricsMiddleware)
+app.add_middleware(ServerTimingMiddleware)
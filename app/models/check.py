@@ -1,6 +1,6 @@
 from pydantic import BaseModel
 
-from app.services.sentiment_predict import SentimentPredictLevel
+from app.models.sentiment import SentimentPredictLevel
 
 
 class SentimentCheckResult(BaseModel):
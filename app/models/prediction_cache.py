@@ -0,0 +1,17 @@
+from pydantic import BaseModel
+from sqlmodel import Field, SQLModel
+
+from app.models.sentiment import SentimentPredictLevel
+
+
+class PredictionCacheEntry(SQLModel, table=True):
+    key: str = Field(primary_key=True, max_length=64)
+    sentiment: SentimentPredictLevel
+
+
+class PredictionCacheStats(BaseModel):
+    memory_hits: int
+    db_hits: int
+    misses: int
+    duplicates: int
+    saved_predictions: int
@@ -0,0 +1,31 @@
+from enum import Enum
+
+from pydantic import BaseModel
+
+
+class SentimentPredictLevel(str, Enum):
+    VERY_NEGATIVE = "very_negative"
+    NEGATIVE = "negative"
+    NEUTRAL = "neutral"
+    POSITIVE = "positive"
+    VERY_POSITIVE = "very_positive"
+
+
+mapper = {
+    0: SentimentPredictLevel.VERY_NEGATIVE,
+    1: SentimentPredictLevel.NEGATIVE,
+    2: SentimentPredictLevel.NEUTRAL,
+    3: SentimentPredictLevel.POSITIVE,
+    4: SentimentPredictLevel.VERY_POSITIVE,
+}
+
+
+class ChunkPrediction(BaseModel):
+    start: int
+    end: int
+    sentiment: SentimentPredictLevel
+
+
+class DocumentPrediction(BaseModel):
+    sentiment: SentimentPredictLevel
+    chunks: list[ChunkPrediction]
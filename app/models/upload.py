@@ -1,10 +1,10 @@
 from datetime import datetime
 from enum import StrEnum
 
-from sqlmodel import Field, Relationship, SQLModel
+from sqlmodel import Field, Index, Relationship, SQLModel
 
+from app.models.sentiment import SentimentPredictLevel
 from app.models.user import User
-from app.services.sentiment_predict import SentimentPredictLevel
 
 
 class UploadEntryBase(SQLModel):
@@ -15,6 +15,9 @@ class UploadEntryBase(SQLModel):
 
 
 class UploadEntry(UploadEntryBase, table=True):
+    # the primary key starts with `id`, entries are looked up by upload
+    __table_args__ = (Index("ix_uploadentry_upload_id_id", "upload_id", "id"),)
+
     upload_id: int = Field(foreign_key="upload.id", primary_key=True, ondelete="CASCADE")
     upload: "Upload" = Relationship(back_populates="entries")
     description: str | None = None
@@ -23,6 +26,22 @@ class UploadEntryPublic(UploadEntryBase):
     id: int
 
 
+class UploadEntryChunkBase(SQLModel):
+    id: int = Field(primary_key=True)
+    start: int
+    end: int
+    sentiment: SentimentPredictLevel
+
+
+class UploadEntryChunk(UploadEntryChunkBase, table=True):
+    upload_id: int = Field(foreign_key="upload.id", primary_key=True, ondelete="CASCADE")
+    entry_id: int = Field(primary_key=True)
+
+
+class UploadEntryChunkPublic(UploadEntryChunkBase):
+    text: str
+
+
 class UploadEntryWithoutUpload(UploadEntryBase):
     pass
 
@@ -40,16 +59,26 @@ class UploadBase(SQLModel):
 
 class UploadFormat(StrEnum):
     PLAIN = "plain"
+    LINES = "lines"
     INTERVIEW_2 = "interview-2"
 
 class Upload(UploadBase, table=True):
+    # listings are ordered newest first and paginated by (created_at, id)
+    __table_args__ = (Index("ix_upload_created_at_id", "created_at", "id"),)
+
     id: int = Field(primary_key=True, default=None)
-    created_at: datetime = Field(default=datetime.now())
-    created_by_user_id: str = Field(foreign_key="user.id")
+    created_at: datetime = Field(default_factory=datetime.now)
+    created_by_user_id: str = Field(foreign_key="user.id", index=True)
     status: UploadStatus = UploadStatus.PENDING
     entries: list["UploadEntry"] = Relationship(back_populates="upload", cascade_delete=True)
     format: UploadFormat = UploadFormat.PLAIN
     created_by: User = Relationship(back_populates="uploads")
+    shards_total: int = 0
+    shards_kicked: int = 0
+    shards_done: int = 0
+    shards_failed: int = 0
+    entries_total: int = 0
+    entries_done: int = 0
 
 
 class UploadPublic(UploadBase):
@@ -58,7 +87,59 @@ class UploadPublic(UploadBase):
     status: UploadStatus
     created_by: User
     format: UploadFormat = UploadFormat.PLAIN
+    entries_total: int = 0
+    entries_done: int = 0
 
 
 class UploadWithEntries(UploadPublic):
     entries: list["UploadEntryWithoutUpload"] = []
+
+
+class UploadWithEntriesPage(UploadWithEntries):
+    next_cursor: int | None = None
+
+
+class UploadProgress(SQLModel):
+    upload_id: int
+    status: UploadStatus
+    entries_done: int = 0
+    entries_total: int = 0
+
+    @property
+    def finished(self) -> bool:
+        return self.status in (UploadStatus.READY, UploadStatus.ERROR)
+
+
+class UploadSummary(SQLModel, table=True):
+    # sentiment counts per upload and question, kept up to date by the
+    # worker; entries without a description are counted under ""
+    upload_id: int = Field(foreign_key="upload.id", primary_key=True, ondelete="CASCADE")
+    question: str = Field(default="", primary_key=True)
+    sentiment: SentimentPredictLevel = Field(primary_key=True)
+    count: int = 0
+
+
+class SentimentCounts(SQLModel):
+    total: int = 0
+    sentiments: dict[SentimentPredictLevel, int] = {}
+
+    @classmethod
+    def from_rows(cls, rows, **kwargs):
+        """Builds counts from `(sentiment, count)` rows."""
+        sentiments = {level: 0 for level in SentimentPredictLevel}
+        for sentiment, count in rows:
+            sentiments[sentiment] += count
+        return cls(total=sum(sentiments.values()), sentiments=sentiments, **kwargs)
+
+
+class UploadQuestionSummary(SentimentCounts):
+    question: str
+
+
+class UploadSummaryPublic(SentimentCounts):
+    upload_id: int
+    questions: list[UploadQuestionSummary] = []
+
+
+class UploadsSummaryPublic(SentimentCounts):
+    uploads: int = 0
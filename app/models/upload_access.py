@@ -1,7 +1,7 @@
 from enum import StrEnum
 
-from pydantic import BaseModel
-from sqlmodel import Field, SQLModel
+from pydantic import BaseModel, Field as PydanticField
+from sqlmodel import Field, Index, SQLModel
 
 
 class AccessRecipientType(StrEnum):
@@ -12,7 +12,15 @@ class UploadAccessRequest(BaseModel):
     recipient_id: str
     recipient_type: AccessRecipientType
 
+class UploadAccessBulkRequest(BaseModel):
+    recipients: list[UploadAccessRequest] = PydanticField(min_length=1, max_length=1000)
+
 class UploadAccess(SQLModel, table=True):
+    __table_args__ = (
+        Index("ix_uploadaccess_upload_id_recipient", "upload_id", "recipient_type", "recipient_id"),
+        Index("ix_uploadaccess_recipient", "recipient_type", "recipient_id"),
+    )
+
     id: int | None = Field(default=None, primary_key=True)
     recipient_id: str
     recipient_type: AccessRecipientType
@@ -23,3 +31,9 @@ class UploadAccessRecipientResponse(BaseModel):
     name: str
     recipient_type: AccessRecipientType
 
+class UploadAccessBulkShareResponse(BaseModel):
+    shared: list[UploadAccessRecipientResponse]
+    already_shared: list[UploadAccessRequest]
+
+class UploadAccessBulkUnshareResponse(BaseModel):
+    removed: int
@@ -4,18 +4,31 @@ from app.models.check import (
     SentimentCheckResponse,
     SentimentCheckResult,
 )
+from app.models.prediction_cache import PredictionCacheStats
+from app.services.batch_scheduler import BatchScheduler
+from app.services.prediction_cache import CachedSentimentPredict, prediction_cache
 from app.services.sentiment_predict import SentimentPredict
+from app.services.timing import TimedRoute, phase
 
-predict = SentimentPredict()
-router = APIRouter()
+predict = CachedSentimentPredict(SentimentPredict(), prediction_cache)
+scheduler = BatchScheduler(predict)
+router = APIRouter(route_class=TimedRoute)
 
 
 @router.get("/check")
-def read_item(
+async def read_item(
     text: list[str] = Query(..., min_items=1, max_items=10, max_length=1000),
 ) -> SentimentCheckResponse:
-    results = []
-    for text in text:
-        results.append(SentimentCheckResult(text=text, sentiment=predict.predict(text)))
+    with phase("inference"):
+        sentiments = await scheduler.predict(text)
+    results = [
+        SentimentCheckResult(text=value, sentiment=sentiment)
+        for value, sentiment in zip(text, sentiments)
+    ]
 
     return SentimentCheckResponse(results=results)
+
+
+@router.get("/check/cache", summary="Get prediction cache hit/miss counters")
+def get_cache_stats() -> PredictionCacheStats:
+    return prediction_cache.stats()
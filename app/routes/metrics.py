@@ -0,0 +1,11 @@
+from fastapi import APIRouter, Response
+
+from app.services.metrics import render_metrics
+
+router = APIRouter(tags=["Metrics"])
+
+
+@router.get("/metrics", summary="Prometheus metrics of this API process")
+def get_metrics() -> Response:
+    content, media_type = render_metrics()
+    return Response(content, media_type=media_type)
@@ -1,35 +1,75 @@
+import base64
 import io
 import re
+from collections import defaultdict
+from collections.abc import Iterable
+from datetime import datetime
 from enum import StrEnum
+from typing import BinaryIO
 
 import docx
-import pandas as pd
-from fastapi import APIRouter, Depends, HTTPException, UploadFile
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, UploadFile
+from fastapi.concurrency import run_in_threadpool
 from fastapi.responses import StreamingResponse
-from sqlmodel import Session, delete, select
-
-from app.broker import process_upload
-from app.dependencies import get_session, get_upload_from_path, get_user
+from sqlalchemy.orm import selectinload
+from sqlmodel import Session, and_, delete, func, or_, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.broker import kick_upload
+from app.dependencies import (
+    can_access_upload,
+    get_async_session,
+    get_session,
+    get_upload_from_path,
+    get_user,
+    invalidate_upload_access,
+)
+from app.models.sentiment import SentimentPredictLevel
 from app.models.upload import (
     Upload,
     UploadEntry,
+    UploadEntryChunk,
+    UploadEntryChunkPublic,
+    UploadEntryWithoutUpload,
     UploadFormat,
     UploadPublic,
+    UploadQuestionSummary,
+    UploadsSummaryPublic,
     UploadStatus,
-    UploadWithEntries,
+    UploadSummary,
+    UploadSummaryPublic,
+    UploadWithEntriesPage,
 )
 from app.models.upload_access import (
     AccessRecipientType,
     UploadAccess,
+    UploadAccessBulkRequest,
+    UploadAccessBulkShareResponse,
+    UploadAccessBulkUnshareResponse,
     UploadAccessRecipientResponse,
     UploadAccessRequest,
 )
 from app.models.user import User
-from app.services.sentiment_predict import SentimentPredict
+from app.services.export import iter_entry_rows, stream_csv, stream_xlsx
+from app.services.ingest import (
+    bulk_insert_entries,
+    iter_csv_rows,
+    iter_text_lines,
+    iter_xlsx_rows,
+)
+from app.services.progress import (
+    DatabaseProgressChannel,
+    MemoryProgressChannel,
+    get_progress_channel,
+    progress_events,
+)
+from app.services.timing import TimedRoute, phase
 
-router = APIRouter(tags=["Uploads"])
+router = APIRouter(tags=["Uploads"], route_class=TimedRoute)
 
-predict = SentimentPredict()
+# entries returned with a newly created upload, the default page size of
+# GET /uploads/{upload_id}
+created_entries_page = 100
 
 
 class DownloadFileType(StrEnum):
@@ -37,67 +77,239 @@ class DownloadFileType(StrEnum):
     XLSX = "xlsx"
 
 
+def encode_upload_cursor(upload: Upload) -> str:
+    return base64.urlsafe_b64encode(
+        f"{upload.created_at.isoformat()}|{upload.id}".encode()
+    ).decode()
+
+
+def decode_upload_cursor(cursor: str) -> tuple[datetime, int]:
+    try:
+        created_at, id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(created_at), int(id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
 @router.get("/uploads", summary="Get all uploads")
 def get_upload(
-    session: Session = Depends(get_session), user: User = Depends(get_user)
+    response: Response,
+    status: list[UploadStatus] | None = Query(None),
+    before: str | None = Query(
+        None, description="Cursor from the X-Next-Cursor header of the previous page"
+    ),
+    limit: int = Query(100, ge=1, le=1000),
+    session: Session = Depends(get_session),
+    user: User = Depends(get_user),
 ) -> list[UploadPublic]:
-    res = list(
-        session.exec(select(Upload).where(Upload.created_by_user_id == user.id)).all()
+    query = (
+        select(Upload)
+        .where(can_access_upload(user))
+        .options(selectinload(Upload.created_by))
+        .order_by(Upload.created_at.desc(), Upload.id.desc())
+        .limit(limit + 1)
     )
+    if status:
+        query = query.where(Upload.status.in_(status))
+    if before:
+        created_at, id = decode_upload_cursor(before)
+        query = query.where(
+            or_(
+                Upload.created_at < created_at,
+                and_(Upload.created_at == created_at, Upload.id < id),
+            )
+        )
 
-    shared_uploads = list(
-        session.exec(
-            select(Upload)
-            .join(UploadAccess)
-            .where(UploadAccess.recipient_id == user.id)
-        ).all()
+    uploads = list(session.exec(query).all())
+    if len(uploads) > limit:
+        uploads = uploads[:limit]
+        response.headers["X-Next-Cursor"] = encode_upload_cursor(uploads[-1])
+
+    return uploads
+
+
+# registered before /uploads/{upload_id}, which would match "summary" too
+@router.get("/uploads/summary", summary="Get sentiment counts across all accessible uploads")
+def get_uploads_summary(
+    session: Session = Depends(get_session),
+    user: User = Depends(get_user),
+) -> UploadsSummaryPublic:
+    accessible = select(Upload.id).where(can_access_upload(user)).subquery()
+    rows = session.exec(
+        select(UploadSummary.sentiment, func.sum(UploadSummary.count))
+        .where(UploadSummary.upload_id.in_(select(accessible.c.id)))
+        .group_by(UploadSummary.sentiment)
+    ).all()
+    uploads = session.exec(select(func.count()).select_from(accessible)).one()
+
+    return UploadsSummaryPublic.from_rows(rows, uploads=uploads)
+
+
+def entry_page_query(
+    upload_id: int,
+    limit: int,
+    after: int | None = None,
+    sentiment: SentimentPredictLevel | None = None,
+):
+    """
+    Entry columns of one page, one more row than `limit` to tell whether
+    there is a next page. Rows are plain tuples, not ORM objects.
+    """
+    query = (
+        select(
+            UploadEntry.id,
+            UploadEntry.text,
+            UploadEntry.description,
+            UploadEntry.sentiment,
+        )
+        .where(UploadEntry.upload_id == upload_id)
+        .order_by(UploadEntry.id)
+        .limit(limit + 1)
     )
+    if after is not None:
+        query = query.where(UploadEntry.id > after)
+    if sentiment is not None:
+        query = query.where(UploadEntry.sentiment == sentiment)
+    return query
 
-    shared_org_uploads = []
-    if user.organization:
-        shared_org_uploads = session.exec(
-            select(Upload)
-            .join(UploadAccess)
-            .where(UploadAccess.recipient_id == user.organization)
-            .where(Upload.created_by_user_id != user.id)
-        ).all()
 
-    return list(res) + list(shared_uploads) + list(shared_org_uploads)
+def entry_page(rows: Iterable, limit: int) -> tuple[list[UploadEntryWithoutUpload], int | None]:
+    """The entries of a page from `entry_page_query` and the next page's cursor."""
+    entries = [
+        UploadEntryWithoutUpload(id=id, text=text, description=description, sentiment=value)
+        for id, text, description, value in rows
+    ]
+    if len(entries) > limit:
+        entries = entries[:limit]
+        return entries, entries[-1].id
+    return entries, None
 
 
 @router.get("/uploads/{upload_id}", summary="Get a specific upload")
 def get_upload_by_id(
+    include_entries: bool = True,
+    after: int | None = Query(None, description="Return entries with id greater than this cursor"),
+    limit: int = Query(100, ge=1, le=1000),
+    sentiment: SentimentPredictLevel | None = None,
+    session: Session = Depends(get_session),
     upload: Upload = Depends(get_upload_from_path),
-) -> UploadWithEntries:
-    return upload
+) -> UploadWithEntriesPage:
+    entries = []
+    next_cursor = None
+
+    if include_entries:
+        entries, next_cursor = entry_page(
+            session.exec(entry_page_query(upload.id, limit, after, sentiment)), limit
+        )
+
+    return UploadWithEntriesPage.model_validate(
+        upload, update={"entries": entries, "next_cursor": next_cursor}
+    )
 
 
 @router.get("/uploads/{upload_id}/download", summary="Download a specific upload")
 def download_upload_by_id(
     type: DownloadFileType = DownloadFileType.XLSX,
+    session: Session = Depends(get_session),
     upload: Upload = Depends(get_upload_from_path),
 ):
-    output = io.BytesIO()
-    df = pd.DataFrame(
-        [
-            {"id": entry.id, "text": entry.text, "sentiment": entry.sentiment.value}
-            for entry in upload.entries
-        ]
-    )
+    # the request session is closed before the body is streamed, so rows are
+    # read through their own session on the same engine
+    rows = iter_entry_rows(session.get_bind(), upload.id)
     if type == DownloadFileType.CSV:
-        df.to_csv(output, index=False)
+        content, media_type = stream_csv(rows), "text/csv"
     else:
-        df.to_excel(output, index=False)
+        content, media_type = (
+            stream_xlsx(rows),
+            "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        )
 
-    output.seek(0)
     return StreamingResponse(
-        output,
+        content,
+        media_type=media_type,
         headers={
             "Content-Disposition": f"attachment; filename={upload.name.replace('.', '-')}-results.{type}"
         },
     )
 
 
+@router.get(
+    "/uploads/{upload_id}/summary", summary="Get sentiment counts of the upload"
+)
+def get_upload_summary(
+    session: Session = Depends(get_session),
+    upload: Upload = Depends(get_upload_from_path),
+) -> UploadSummaryPublic:
+    rows = session.exec(
+        select(UploadSummary.question, UploadSummary.sentiment, UploadSummary.count)
+        .where(UploadSummary.upload_id == upload.id)
+        .order_by(UploadSummary.question)
+    ).all()
+
+    questions = defaultdict(list)
+    for question, sentiment, count in rows:
+        questions[question].append((sentiment, count))
+
+    return UploadSummaryPublic.from_rows(
+        [(sentiment, count) for _, sentiment, count in rows],
+        upload_id=upload.id,
+        # uploads without descriptions have nothing to break down
+        questions=[
+            UploadQuestionSummary.from_rows(counts, question=question)
+            for question, counts in questions.items()
+            if question
+        ],
+    )
+
+
+@router.get(
+    "/uploads/{upload_id}/progress",
+    summary="Stream processing progress of the upload as server-sent events",
+)
+def get_upload_progress(
+    upload: Upload = Depends(get_upload_from_path),
+    channel: DatabaseProgressChannel | MemoryProgressChannel = Depends(get_progress_channel),
+) -> StreamingResponse:
+    return StreamingResponse(
+        progress_events(channel, upload.id),
+        media_type="text/event-stream",
+        # proxies must pass events through as they arrive
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.get(
+    "/uploads/{upload_id}/entries/{entry_id}/chunks",
+    summary="Get per-chunk results of a long entry",
+)
+def get_upload_entry_chunks(
+    entry_id: int,
+    session: Session = Depends(get_session),
+    upload: Upload = Depends(get_upload_from_path),
+) -> list[UploadEntryChunkPublic]:
+    entry = session.get(UploadEntry, {"id": entry_id, "upload_id": upload.id})
+    if not entry:
+        raise HTTPException(status_code=404, detail="Entry not found")
+
+    chunks = session.exec(
+        select(UploadEntryChunk)
+        .where(UploadEntryChunk.upload_id == upload.id)
+        .where(UploadEntryChunk.entry_id == entry_id)
+        .order_by(UploadEntryChunk.id)
+    ).all()
+
+    return [
+        UploadEntryChunkPublic(
+            id=chunk.id,
+            start=chunk.start,
+            end=chunk.end,
+            sentiment=chunk.sentiment,
+            text=entry.text[chunk.start : chunk.end],
+        )
+        for chunk in chunks
+    ]
+
+
 @router.delete(
     "/uploads/{upload_id}", summary="Delete a specific upload", status_code=204
 )
@@ -107,105 +319,125 @@ def delete_upload_by_id(
 ):
     session.exec(delete(Upload).where(Upload.id == upload.id))
     session.exec(delete(UploadEntry).where(UploadEntry.upload_id == upload.id))
+    session.exec(delete(UploadEntryChunk).where(UploadEntryChunk.upload_id == upload.id))
+    session.exec(delete(UploadSummary).where(UploadSummary.upload_id == upload.id))
     session.commit()
+    invalidate_upload_access(upload.id)
 
 
-@router.post(
-    "/uploads",
-    summary="Upload a new file for sentiment check",
-    response_model=UploadWithEntries,
-)
-async def upload_file(
-    file: UploadFile,
-    format: UploadFormat = UploadFormat.PLAIN,
-    session: Session = Depends(get_session),
-    user: User = Depends(get_user),
-) -> Upload:
-    if file.content_type in ["application/vnd.ms-excel", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"]:
-        b = await file.read()
-        df = pd.read_excel(io.BytesIO(b), header=None, index_col=None)
-        df.columns = ["text"]
-
-        upload = Upload(
-            name=file.filename, created_by_user_id=user.id, status=UploadStatus.PENDING
-        )
-        session.add(upload)
-        session.commit()
-        session.refresh(upload)
+xlsx_content_types = [
+    "application/vnd.ms-excel",
+    "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+]
+docx_content_types = [
+    "application/msword",
+    "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+]
+csv_content_types = ["text/csv", "application/csv"]
 
-        entries = []
-        for i, row in df.iterrows():
-            entry = UploadEntry(upload_id=upload.id, text=row["text"], sentiment=None, id=i)
-            session.add(entry)
-            entries.append(entry)
-        session.commit()
-        session.refresh(upload)
-
-        await process_upload.kiq(upload_id=upload.id)
-        return upload
-    elif file.content_type in ["application/msword", "application/vnd.openxmlformats-officedocument.wordprocessingml.document"]:
-        b = await file.read()
-        doc = docx.Document(io.BytesIO(b))
-        full_text = "\n".join([para.text for para in doc.paragraphs if para.text.strip()])
-        
-        if format == UploadFormat.INTERVIEW_2:
-            p = re.compile(r"(?P<title>.+)\n+Респондент:\s*(?P<respondent>.+)\nДата интервью:\s*(?P<date>\d{2}\/\d{2}\/\d{4})\n*(?P<qas>[\s\S]+)")
-            qas = re.compile(r"((?P<q>\d+\.\s[^\n]+)\n+(?P<a>[^\n]+\n*))")
-            res = p.match(full_text)
 
-            description = f"{res.group("title")} - {res.group("respondent")} - {res.group("date")}"
+def is_csv(file: UploadFile) -> bool:
+    # browsers on Windows send .csv files as application/vnd.ms-excel
+    return file.content_type in csv_content_types or (
+        file.filename or ""
+    ).lower().endswith(".csv")
 
 
+def parse_docx(file: BinaryIO, format: UploadFormat) -> tuple[str | None, list[dict]]:
+    doc = docx.Document(file)
+    full_text = "\n".join([para.text for para in doc.paragraphs if para.text.strip()])
 
-            upload = Upload(name=description, description=description, created_by_user_id=user.id, status=UploadStatus.PENDING)
-            session.add(upload)
-            session.commit()
-            session.refresh(upload)
+    if format == UploadFormat.INTERVIEW_2:
+        p = re.compile(r"(?P<title>.+)\n+Респондент:\s*(?P<respondent>.+)\nДата интервью:\s*(?P<date>\d{2}\/\d{2}\/\d{4})\n*(?P<qas>[\s\S]+)")
+        qas = re.compile(r"((?P<q>\d+\.\s[^\n]+)\n+(?P<a>[^\n]+\n*))")
+        res = p.match(full_text)
 
-            for i, qa in enumerate(qas.finditer(res.group("qas"))):
-                entry = UploadEntry(upload_id=upload.id, text=qa.group("a"), sentiment=None, description=qa.group("q"), id=i)
-                session.add(entry)
-            
-            session.commit()
-            session.refresh(upload)
-            await process_upload.kiq(upload_id=upload.id)
-            return upload
+        description = f"{res.group('title')} - {res.group('respondent')} - {res.group('date')}"
 
-        # Create a new Upload record
-        upload = Upload(
-            name=file.filename, created_by_user_id=user.id, status=UploadStatus.PENDING
-        )
-        session.add(upload)
-        session.commit()
-        session.refresh(upload)
+        return description, [
+            {"id": i, "text": qa.group("a"), "description": qa.group("q")}
+            for i, qa in enumerate(qas.finditer(res.group("qas")))
+        ]
 
-        # Process the Word file content as one single entry
-        entry = UploadEntry(upload_id=upload.id, text=full_text, sentiment=None, id=1)
-        session.add(entry)
-        session.commit()
-        session.refresh(upload)
+    # Process the Word file content as one single entry
+    return None, [{"id": 1, "text": full_text}]
 
-        # Queue processing task
-        await process_upload.kiq(upload_id=upload.id)
-        return upload
-    elif file.content_type in ["text/plain"]:
-        b = await file.read()
-        text = b.decode("utf-8")
 
-        upload = Upload(
-            name=file.filename, created_by_user_id=user.id, status=UploadStatus.PENDING
+def read_text(file: BinaryIO) -> list[dict]:
+    return [{"id": 1, "text": io.TextIOWrapper(file, encoding="utf-8").read()}]
+
+
+async def create_upload(
+    session: AsyncSession,
+    user: User,
+    name: str,
+    rows: Iterable[dict],
+    format: UploadFormat = UploadFormat.PLAIN,
+) -> UploadWithEntriesPage:
+    upload = Upload(
+        name=name, created_by_user_id=user.id, status=UploadStatus.PENDING, format=format
+    )
+    session.add(upload)
+    await session.flush()
+
+    # the upload row and its entries are committed together, so the worker
+    # never sees a half-inserted upload
+    entries = await bulk_insert_entries(session, upload.id, rows)
+    await session.commit()
+
+    await kick_upload(upload.id, entries)
+
+    # relationships can't be lazy-loaded on an async session
+    upload = (
+        await session.exec(
+            select(Upload)
+            .where(Upload.id == upload.id)
+            .options(selectinload(Upload.created_by))
+            .execution_options(populate_existing=True)
         )
-        session.add(upload)
-        session.commit()
-        session.refresh(upload)
+    ).one()
+
+    # only the first page of entries is returned, the rest is paged through
+    # GET /uploads/{upload_id}
+    page, next_cursor = entry_page(
+        await session.exec(entry_page_query(upload.id, created_entries_page)),
+        created_entries_page,
+    )
+    return UploadWithEntriesPage.model_validate(
+        upload, update={"entries": page, "next_cursor": next_cursor}
+    )
 
-        entry = UploadEntry(upload_id=upload.id, text=text, sentiment=None, id=1)
-        session.add(entry)
-        session.commit()
-        session.refresh(upload)
 
-        await process_upload.kiq(upload_id=upload.id)
-        return upload
+@router.post(
+    "/uploads",
+    summary="Upload a new file for sentiment check",
+)
+async def upload_file(
+    file: UploadFile,
+    format: UploadFormat = UploadFormat.PLAIN,
+    session: AsyncSession = Depends(get_async_session),
+    user: User = Depends(get_user),
+) -> UploadWithEntriesPage:
+    # UploadFile is spooled to a temporary file on disk once it grows past
+    # 1 MB, so the parsers below read it incrementally from there
+    if is_csv(file):
+        return await create_upload(session, user, file.filename, iter_csv_rows(file.file))
+    elif file.content_type in xlsx_content_types:
+        return await create_upload(session, user, file.filename, iter_xlsx_rows(file.file))
+    elif file.content_type in docx_content_types:
+        with phase("parse"):
+            name, rows = await run_in_threadpool(parse_docx, file.file, format)
+        if format == UploadFormat.INTERVIEW_2:
+            return await create_upload(session, user, name, rows, format=format)
+        return await create_upload(session, user, file.filename, rows)
+    elif file.content_type in ["text/plain"]:
+        if format == UploadFormat.LINES:
+            return await create_upload(
+                session, user, file.filename, iter_text_lines(file.file), format=format
+            )
+        with phase("parse"):
+            rows = await run_in_threadpool(read_text, file.file)
+        return await create_upload(session, user, file.filename, rows)
     else:
         raise HTTPException(status_code=400, detail="File type not supported")
 
@@ -218,41 +450,29 @@ def get_upload_share(
     session: Session = Depends(get_session),
     upload: Upload = Depends(get_upload_from_path),
 ) -> list[UploadAccessRecipientResponse]:
-    
-    res: list[UploadAccessRecipientResponse] = []
-
-    users = session.exec(
-        select(UploadAccess)
-        .where(UploadAccess.upload_id == upload.id)
-        .where(UploadAccess.recipient_type == AccessRecipientType.USER)
-    ).all()
-
-    for user in users:
-        user_in_db = session.exec(select(User).where(User.id == user.recipient_id)).first()
-        res.append(
-            UploadAccessRecipientResponse(
-                recipient_id=user.recipient_id,
-                recipient_type=user.recipient_type,
-                name=user_in_db.email,
-            )
+    # user grants are joined with their emails, org grants are named by the
+    # org itself
+    rows = session.exec(
+        select(UploadAccess, User.email)
+        .outerjoin(
+            User,
+            and_(
+                UploadAccess.recipient_type == AccessRecipientType.USER,
+                User.id == UploadAccess.recipient_id,
+            ),
         )
-
-    orgs = session.exec(
-        select(UploadAccess)
         .where(UploadAccess.upload_id == upload.id)
-        .where(UploadAccess.recipient_type == AccessRecipientType.ORG)
+        .order_by(UploadAccess.recipient_type.desc(), UploadAccess.id)
     ).all()
 
-    for org in orgs:
-        res.append(
-            UploadAccessRecipientResponse(
-                recipient_id=org.recipient_id,
-                recipient_type=org.recipient_type,
-                name=org.recipient_id,
-            )
+    return [
+        UploadAccessRecipientResponse(
+            recipient_id=access.recipient_id,
+            recipient_type=access.recipient_type,
+            name=email or access.recipient_id,
         )
-
-    return res
+        for access, email in rows
+    ]
 
 
 @router.post("/uploads/{upload_id}/share", summary="Share the upload with a user")
@@ -291,6 +511,7 @@ def share_upload(
 
         session.add(access)
         session.commit()
+        invalidate_upload_access(upload.id)
         return access
 
     else:
@@ -307,6 +528,7 @@ def share_upload(
         )
         session.add(access)
         session.commit()
+        invalidate_upload_access(upload.id)
         return access
 
 
@@ -333,3 +555,136 @@ def unshare_upload(
         .where(UploadAccess.recipient_type == request.recipient_type)
     )
     session.commit()
+    invalidate_upload_access(upload.id)
+
+
+@router.post(
+    "/uploads/{upload_id}/share/bulk",
+    summary="Share the upload with several users and organizations",
+)
+def share_upload_bulk(
+    request: UploadAccessBulkRequest,
+    user: User = Depends(get_user),
+    session: Session = Depends(get_session),
+    upload: Upload = Depends(get_upload_from_path),
+) -> UploadAccessBulkShareResponse:
+    recipients = list(
+        {(r.recipient_type, r.recipient_id): r for r in request.recipients}.values()
+    )
+    emails = {
+        r.recipient_id for r in recipients if r.recipient_type == AccessRecipientType.USER
+    }
+    orgs = {
+        r.recipient_id for r in recipients if r.recipient_type == AccessRecipientType.ORG
+    }
+
+    user_ids = dict(
+        session.exec(select(User.email, User.id).where(User.email.in_(emails))).all()
+    ) if emails else {}
+    known_orgs = set(
+        session.exec(
+            select(User.organization).where(User.organization.in_(orgs)).distinct()
+        ).all()
+    ) if orgs else set()
+
+    if missing := sorted(emails - user_ids.keys()):
+        raise HTTPException(
+            status_code=404, detail=f"Users with such emails not found: {', '.join(missing)}"
+        )
+    if missing := sorted(orgs - known_orgs):
+        raise HTTPException(status_code=404, detail=f"Orgs not found: {', '.join(missing)}")
+    if user.id in user_ids.values():
+        raise HTTPException(status_code=400, detail="Cannot share with yourself")
+
+    # grants are stored by user id, but requested by email
+    wanted = {
+        (
+            r.recipient_type,
+            user_ids[r.recipient_id]
+            if r.recipient_type == AccessRecipientType.USER
+            else r.recipient_id,
+        ): r
+        for r in recipients
+    }
+    existing = set(
+        session.exec(
+            select(UploadAccess.recipient_type, UploadAccess.recipient_id)
+            .where(UploadAccess.upload_id == upload.id)
+            .where(
+                or_(
+                    *(
+                        and_(
+                            UploadAccess.recipient_type == recipient_type,
+                            UploadAccess.recipient_id.in_(
+                                [id for type_, id in wanted if type_ == recipient_type]
+                            ),
+                        )
+                        for recipient_type in AccessRecipientType
+                    )
+                )
+            )
+        ).all()
+    )
+
+    shared = [key for key in wanted if key not in existing]
+    session.add_all(
+        UploadAccess(upload_id=upload.id, recipient_id=recipient_id, recipient_type=recipient_type)
+        for recipient_type, recipient_id in shared
+    )
+    session.commit()
+    invalidate_upload_access(upload.id)
+
+    return UploadAccessBulkShareResponse(
+        shared=[
+            UploadAccessRecipientResponse(
+                recipient_id=recipient_id,
+                recipient_type=recipient_type,
+                name=wanted[recipient_type, recipient_id].recipient_id,
+            )
+            for recipient_type, recipient_id in shared
+        ],
+        already_shared=[wanted[key] for key in wanted if key in existing],
+    )
+
+
+@router.delete(
+    "/uploads/{upload_id}/share/bulk",
+    summary="Remove several users and organizations from the upload share",
+)
+def unshare_upload_bulk(
+    request: UploadAccessBulkRequest,
+    user: User = Depends(get_user),
+    session: Session = Depends(get_session),
+    upload: Upload = Depends(get_upload_from_path),
+) -> UploadAccessBulkUnshareResponse:
+    if upload.created_by_user_id != user.id:
+        if any(r.recipient_type == AccessRecipientType.ORG for r in request.recipients):
+            raise HTTPException(status_code=403, detail="Only owner can remove organization from share")
+        if any(r.recipient_id != user.id for r in request.recipients):
+            raise HTTPException(status_code=403, detail="You can only remove yourself as you are not an owner of upload")
+
+    result = session.exec(
+        delete(UploadAccess)
+        .where(UploadAccess.upload_id == upload.id)
+        .where(
+            or_(
+                *(
+                    and_(
+                        UploadAccess.recipient_type == recipient_type,
+                        UploadAccess.recipient_id.in_(
+                            [
+                                r.recipient_id
+                                for r in request.recipients
+                                if r.recipient_type == recipient_type
+                            ]
+                        ),
+                    )
+                    for recipient_type in AccessRecipientType
+                )
+            )
+        )
+    )
+    session.commit()
+    invalidate_upload_access(upload.id)
+
+    return UploadAccessBulkUnshareResponse(removed=result.rowcount)
@@ -2,8 +2,9 @@ from fastapi import APIRouter, Depends
 
 from app.dependencies import get_user
 from app.models.user import User
+from app.services.timing import TimedRoute
 
-router = APIRouter(tags=["Users"])
+router = APIRouter(tags=["Users"], route_class=TimedRoute)
 
 
 @router.get("/users/me", summary="Get information about the current user")
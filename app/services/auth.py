@@ -0,0 +1,111 @@
+import hashlib
+import threading
+import time
+from collections.abc import Callable
+
+import jwt
+
+from app.models.keycloak import KeycloakIDToken
+from app.services.cache import LRUCache
+from app.settings import settings
+
+
+class JWKSCache:
+    """
+    Process-wide cache of the identity provider's signing keys.
+
+    Keys are refetched once `ttl` seconds passed, or when a token is signed
+    with an unknown `kid` (key rotation), at most once per
+    `min_refresh_interval`. If a periodic refetch fails, the previous keys
+    stay in use so a slow IdP doesn't fail every request.
+    """
+
+    def __init__(
+        self,
+        fetch: Callable[[], dict],
+        ttl: float = settings.jwks_cache_ttl,
+        min_refresh_interval: float = 10,
+    ):
+        self.fetch = fetch
+        self.ttl = ttl
+        self.min_refresh_interval = min_refresh_interval
+        self._keys: dict[str, jwt.PyJWK] = {}
+        self._fetched_at: float | None = None
+        self._lock = threading.Lock()
+
+    def get_signing_key(self, kid: str) -> jwt.PyJWK:
+        if self._fetched_at is None or time.monotonic() - self._fetched_at > self.ttl:
+            self._refresh(keep_stale=True)
+
+        key = self._keys.get(kid)
+        if key is None and time.monotonic() - self._fetched_at >= self.min_refresh_interval:
+            self._refresh()
+            key = self._keys.get(kid)
+
+        if key is None:
+            raise jwt.exceptions.InvalidTokenError(f"Unknown signing key: {kid}")
+        return key
+
+    def _refresh(self, keep_stale: bool = False):
+        fetched_at = self._fetched_at
+        with self._lock:
+            # another thread refreshed the keys while we were waiting
+            if self._fetched_at != fetched_at:
+                return
+
+            try:
+                jwk_set = jwt.PyJWKSet.from_dict(self.fetch())
+            except jwt.exceptions.PyJWKClientConnectionError:
+                if not (keep_stale and self._keys):
+                    raise
+                # retry on the next request after `min_refresh_interval`
+                self._fetched_at = time.monotonic() - self.ttl + self.min_refresh_interval
+                return
+
+            self._keys = {key.key_id: key for key in jwk_set.keys}
+            self._fetched_at = time.monotonic()
+
+
+class TokenVerifier:
+    """
+    Verifies bearer tokens against a `JWKSCache` and remembers verified
+    tokens, keyed by their hash, until they expire.
+    """
+
+    def __init__(self, jwks: JWKSCache, cache_size: int = settings.token_cache_size):
+        self.jwks = jwks
+        self.tokens = LRUCache(cache_size)
+
+    def verify(self, token: str) -> KeycloakIDToken:
+        key = hashlib.sha256(token.encode()).hexdigest()
+        id_token = self.tokens.get(key)
+        if id_token is not None:
+            return id_token
+
+        signing_key = self.jwks.get_signing_key(jwt.get_unverified_header(token).get("kid"))
+        data = jwt.decode(
+            token,
+            signing_key.key,
+            algorithms=["RS256"],
+            audience="profile",
+            options={"verify_exp": True, "verify_aud": False, "verify_at_hash": False},
+        )
+        id_token = KeycloakIDToken.model_validate(data)
+
+        ttl = id_token.exp - time.time()
+        if ttl > 0:
+            self.tokens.set(key, id_token, ttl=ttl)
+        return id_token
+
+
+def fetch_keycloak_jwks() -> dict:
+    client = jwt.PyJWKClient(
+        f"{settings.oidc_base_url}/protocol/openid-connect/certs",
+        cache_jwk_set=False,
+        headers={"User-agent": "custom-user-agent"},
+        timeout=settings.jwks_fetch_timeout,
+    )
+    return client.fetch_data()
+
+
+token_verifier = TokenVerifier(JWKSCache(fetch_keycloak_jwks))
@@ -0,0 +1,96 @@
+import asyncio
+
+from app.models.sentiment import SentimentPredictLevel
+from app.services.sentiment_predict import SentimentPredict
+from app.settings import settings
+
+
+class BatchScheduler:
+    """
+    Collects texts from concurrent callers into a shared queue and scores them
+    with one `predict_batch` call per flush.
+
+    A flush happens once `max_batch_size` texts are queued or `max_wait_ms`
+    passed since the first text of the batch arrived.
+    """
+
+    def __init__(
+        self,
+        predictor: SentimentPredict,
+        max_batch_size: int = settings.check_batch_max_size,
+        max_wait_ms: float = settings.check_batch_max_wait_ms,
+    ):
+        self.predictor = predictor
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._queue: asyncio.Queue | None = None
+        self._worker: asyncio.Task | None = None
+
+    async def predict(self, values: list[str]) -> list[SentimentPredictLevel]:
+        queue = self._ensure_worker()
+        loop = asyncio.get_running_loop()
+
+        futures = []
+        for value in values:
+            future = loop.create_future()
+            queue.put_nowait((value, future))
+            futures.append(future)
+
+        return list(await asyncio.gather(*futures))
+
+    def _ensure_worker(self) -> asyncio.Queue:
+        # the queue and the worker task are bound to the loop they were
+        # created in, so they are recreated if the scheduler is used from
+        # another loop (e.g. a new TestClient portal)
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop or self._worker is None or self._worker.done():
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._worker = loop.create_task(self._run(self._queue))
+        return self._queue
+
+    async def _run(self, queue: asyncio.Queue):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await queue.get()]
+            deadline = loop.time() + self.max_wait
+
+            while len(batch) < self.max_batch_size:
+                if not queue.empty():
+                    batch.append(queue.get_nowait())
+                    continue
+
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            await self._flush(batch)
+
+    async def _flush(self, batch: list[tuple[str, asyncio.Future]]):
+        try:
+            results = await asyncio.to_thread(
+                self.predictor.predict_batch, [value for value, _ in batch]
+            )
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+    async def shutdown(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
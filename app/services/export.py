@@ -0,0 +1,65 @@
+import csv
+import io
+import tempfile
+from collections.abc import Iterator
+
+import openpyxl
+from sqlalchemy.engine import Engine
+from sqlmodel import Session, select
+
+from app.models.upload import UploadEntry
+from app.settings import settings
+
+export_columns = ["id", "text", "sentiment"]
+
+
+def iter_entry_rows(bind: Engine, upload_id: int) -> Iterator[tuple]:
+    """
+    Yields `(id, text, sentiment)` rows of an upload, fetched in batches of
+    `settings.export_batch_size` through a server-side cursor where the
+    database supports one.
+    """
+    with Session(bind) as session:
+        rows = session.exec(
+            select(UploadEntry.id, UploadEntry.text, UploadEntry.sentiment)
+            .where(UploadEntry.upload_id == upload_id)
+            .order_by(UploadEntry.id)
+            .execution_options(yield_per=settings.export_batch_size)
+        )
+        for id, text, sentiment in rows:
+            yield id, text, sentiment.value if sentiment else ""
+
+
+def stream_csv(rows: Iterator[tuple]) -> Iterator[str]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    writer.writerow(export_columns)
+
+    for i, row in enumerate(rows, 1):
+        writer.writerow(row)
+        if i % settings.export_batch_size == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+
+    yield buffer.getvalue()
+
+
+def stream_xlsx(rows: Iterator[tuple], chunk_size: int = 64 * 1024) -> Iterator[bytes]:
+    """
+    Builds the workbook in write-only mode, which streams rows to a
+    temporary file instead of keeping them in memory, and then yields the
+    finished file in chunks. XLSX is a zip archive, so no bytes can be sent
+    before the last row is written.
+    """
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    sheet.append(export_columns)
+    for row in rows:
+        sheet.append(row)
+
+    with tempfile.TemporaryFile() as file:
+        workbook.save(file)
+        file.seek(0)
+        while chunk := file.read(chunk_size):
+            yield chunk
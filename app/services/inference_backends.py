@@ -0,0 +1,111 @@
+import os
+
+import numpy as np
+
+
+class TorchBackend:
+    """Eager fp32 PyTorch model."""
+
+    name = "torch"
+
+    def __init__(self, model, tokenizer):
+        self.model = model
+
+    def logits(self, inputs: dict[str, np.ndarray]) -> np.ndarray:
+        import torch
+
+        with torch.no_grad():
+            outputs = self.model(
+                **{key: torch.from_numpy(value) for key, value in inputs.items()}
+            )
+        return outputs.logits.numpy()
+
+
+class QuantizedTorchBackend(TorchBackend):
+    """PyTorch model with int8 dynamically quantized linear layers."""
+
+    name = "quantized"
+
+    def __init__(self, model, tokenizer):
+        import torch
+
+        super().__init__(
+            torch.ao.quantization.quantize_dynamic(
+                model, {torch.nn.Linear}, dtype=torch.qint8
+            ),
+            tokenizer,
+        )
+
+
+class OnnxBackend:
+    """
+    ONNX Runtime session on CPU. The model is exported from the PyTorch
+    weights to `settings.onnx_model_path` the first time it is needed.
+    """
+
+    name = "onnx"
+
+    def __init__(self, model, tokenizer, path: str | None = None):
+        try:
+            import onnxruntime
+        except ImportError as e:
+            raise RuntimeError(
+                "onnxruntime is required for the 'onnx' inference backend"
+            ) from e
+
+        from app.settings import settings
+
+        path = path or settings.onnx_model_path
+        if not os.path.exists(path):
+            export_onnx(model, tokenizer, path)
+
+        self.session = onnxruntime.InferenceSession(
+            path, providers=["CPUExecutionProvider"]
+        )
+        self.input_names = {node.name for node in self.session.get_inputs()}
+
+    def logits(self, inputs: dict[str, np.ndarray]) -> np.ndarray:
+        return self.session.run(
+            ["logits"],
+            {key: value for key, value in inputs.items() if key in self.input_names},
+        )[0]
+
+
+def export_onnx(model, tokenizer, path: str):
+    import torch
+
+    sample = tokenizer(["warm up"], return_tensors="pt")
+    input_names = list(sample.keys())
+
+    class LogitsOnly(torch.nn.Module):
+        def __init__(self):
+            super().__init__()
+            self.model = model
+
+        def forward(self, *args):
+            return self.model(**dict(zip(input_names, args))).logits
+
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    # export to a temporary file first so a crashed export never leaves a
+    # truncated model behind for the next process to pick up
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    torch.onnx.export(
+        LogitsOnly().eval(),
+        tuple(sample[name] for name in input_names),
+        tmp_path,
+        input_names=input_names,
+        output_names=["logits"],
+        dynamic_axes={
+            **{name: {0: "batch", 1: "sequence"} for name in input_names},
+            "logits": {0: "batch"},
+        },
+        opset_version=14,
+    )
+    os.replace(tmp_path, path)
+
+
+backends = {
+    TorchBackend.name: TorchBackend,
+    QuantizedTorchBackend.name: QuantizedTorchBackend,
+    OnnxBackend.name: OnnxBackend,
+}
@@ -0,0 +1,116 @@
+import asyncio
+import csv
+import io
+from collections.abc import Iterable, Iterator
+from itertools import islice
+from typing import BinaryIO
+
+import openpyxl
+
+from sqlalchemy import insert
+from sqlalchemy.ext.asyncio import AsyncConnection
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.models.upload import UploadEntry
+from app.services.timing import phase
+from app.settings import settings
+
+_copy_columns = ("upload_id", "id", "text", "description")
+
+
+def batched(rows: Iterable, size: int) -> Iterator[list]:
+    iterator = iter(rows)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def iter_xlsx_rows(file: BinaryIO) -> Iterator[dict]:
+    """
+    Yields the first column of the active sheet as entries. The workbook is
+    opened in read-only mode, so rows are parsed lazily instead of loading
+    the whole sheet.
+    """
+    workbook = openpyxl.load_workbook(file, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(max_col=1, values_only=True)
+        yield from _entries(row[0] if row else None for row in rows)
+    finally:
+        workbook.close()
+
+
+def iter_csv_rows(file: BinaryIO, encoding: str = "utf-8-sig") -> Iterator[dict]:
+    """Yields the first column of a headerless CSV file as entries."""
+    reader = csv.reader(io.TextIOWrapper(file, encoding=encoding, newline=""))
+    yield from _entries(row[0] if row else None for row in reader)
+
+
+def iter_text_lines(file: BinaryIO, encoding: str = "utf-8") -> Iterator[dict]:
+    """Yields every line of a text file as an entry."""
+    yield from _entries(io.TextIOWrapper(file, encoding=encoding))
+
+
+def _entries(values: Iterable) -> Iterator[dict]:
+    # empty cells and blank lines are skipped so they aren't scored
+    i = 0
+    for value in values:
+        if value is None:
+            continue
+        text = str(value).strip()
+        if not text:
+            continue
+        yield {"id": i, "text": text}
+        i += 1
+
+
+async def _copy_entries(connection: AsyncConnection, rows: list[dict]):
+    raw_connection = await connection.get_raw_connection()
+    await raw_connection.driver_connection.copy_records_to_table(
+        UploadEntry.__tablename__,
+        records=[tuple(row[column] for column in _copy_columns) for row in rows],
+        columns=_copy_columns,
+    )
+
+
+async def bulk_insert_entries(
+    session: AsyncSession,
+    upload_id: int,
+    rows: Iterable[dict],
+    batch_size: int | None = None,
+) -> int:
+    """
+    Writes upload entries in large batches without building ORM objects.
+
+    `rows` are dicts with `id`, `text` and an optional `description`,
+    usually produced lazily by a parser over the uploaded file, so every
+    batch is parsed in a worker thread. On PostgreSQL with asyncpg every
+    batch is sent with `COPY`, elsewhere as one executemany INSERT. Returns
+    the number of inserted entries; the caller commits.
+    """
+    connection = await session.connection()
+    use_copy = (
+        connection.dialect.name == "postgresql" and connection.dialect.driver == "asyncpg"
+    )
+
+    batches = batched(rows, batch_size or settings.ingest_batch_size)
+    count = 0
+    while True:
+        with phase("parse"):
+            batch = await asyncio.to_thread(next, batches, None)
+        if batch is None:
+            break
+        values = [
+            {
+                "upload_id": upload_id,
+                "id": row["id"],
+                "text": row["text"],
+                "description": row.get("description"),
+            }
+            for row in batch
+        ]
+        if use_copy:
+            await _copy_entries(connection, values)
+        else:
+            await session.exec(insert(UploadEntry), params=values)
+        count += len(values)
+
+    return count
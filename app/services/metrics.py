@@ -0,0 +1,209 @@
+"""
+Prometheus metrics of the API and the worker.
+
+Importing this module registers the SQLAlchemy listeners that time every
+query. The API serves the metrics on `/metrics`, every worker process on
+its own port from `settings.worker_metrics_port`.
+"""
+
+import logging
+import os
+import time
+from contextvars import ContextVar
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    generate_latest,
+    start_http_server,
+)
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from starlette.routing import Match
+from taskiq import TaskiqMessage, TaskiqMiddleware, TaskiqResult
+
+from app.services.timing import add_timing
+
+logger = logging.getLogger(__name__)
+
+http_request_seconds = Histogram(
+    "http_request_duration_seconds",
+    "Time to serve a request, including a streamed body",
+    ["method", "route", "status"],
+)
+http_request_db_queries = Histogram(
+    "http_request_db_queries",
+    "Database queries per request",
+    ["method", "route"],
+    buckets=(0, 1, 2, 3, 5, 10, 20, 50, 100),
+)
+http_request_db_seconds = Histogram(
+    "http_request_db_seconds",
+    "Time spent in database queries per request",
+    ["method", "route"],
+)
+db_query_seconds = Histogram("db_query_duration_seconds", "Database query time")
+
+predict_tokenize_seconds = Histogram(
+    "predict_tokenize_seconds", "Time to tokenize a call's texts", ["backend"]
+)
+predict_forward_seconds = Histogram(
+    "predict_forward_seconds", "Time of one model forward pass", ["backend"]
+)
+predict_batch_size = Histogram(
+    "predict_batch_size",
+    "Sequences per model forward pass",
+    ["backend"],
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256),
+)
+predict_tokens = Counter(
+    "predict_tokens", "Tokens run through the model, without padding", ["backend"]
+)
+
+task_queue_wait_seconds = Histogram(
+    "task_queue_wait_seconds",
+    "Time from kicking a task until a worker starts it",
+    ["task"],
+    buckets=(0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300, 900, 3600),
+)
+task_seconds = Histogram(
+    "task_duration_seconds",
+    "Task execution time",
+    ["task", "status"],
+    buckets=(0.1, 0.5, 1, 5, 10, 30, 60, 300, 900, 3600),
+)
+upload_entries_processed = Counter("upload_entries_processed", "Scored upload entries")
+upload_entries = Histogram(
+    "upload_entries",
+    "Entries per finished upload",
+    buckets=(1, 10, 100, 1000, 10000, 100000, 1000000),
+)
+
+
+class RequestStats:
+    def __init__(self):
+        self.queries = 0
+        self.seconds = 0.0
+
+
+# shared with the threadpool and tasks a request spawns, which run on a
+# copy of its context
+_request_stats: ContextVar[RequestStats | None] = ContextVar("request_stats", default=None)
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_started_at", []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _stop_query_timer(conn, cursor, statement, parameters, context, executemany):
+    seconds = time.perf_counter() - conn.info["query_started_at"].pop()
+    db_query_seconds.observe(seconds)
+    add_timing("db", seconds)
+
+    stats = _request_stats.get()
+    if stats is not None:
+        stats.queries += 1
+        stats.seconds += seconds
+
+
+def route_template(scope) -> str:
+    # the path template keeps the label cardinality bounded
+    for route in scope["app"].router.routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return getattr(route, "path", scope["path"])
+    return "unmatched"
+
+
+class MetricsMiddleware:
+    """ASGI middleware observing the latency and database use of requests."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        stats = RequestStats()
+        token = _request_stats.set(stats)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            seconds = time.perf_counter() - start
+            _request_stats.reset(token)
+
+            route = route_template(scope)
+            http_request_seconds.labels(scope["method"], route, status).observe(seconds)
+            http_request_db_queries.labels(scope["method"], route).observe(stats.queries)
+            http_request_db_seconds.labels(scope["method"], route).observe(stats.seconds)
+
+
+def metrics_registry() -> CollectorRegistry:
+    # with several API processes, every process writes its samples to
+    # PROMETHEUS_MULTIPROC_DIR and any of them serves the sum
+    if "PROMETHEUS_MULTIPROC_DIR" not in os.environ:
+        return REGISTRY
+
+    from prometheus_client import multiprocess
+
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return registry
+
+
+def render_metrics() -> tuple[bytes, str]:
+    return generate_latest(metrics_registry()), CONTENT_TYPE_LATEST
+
+
+class TaskMetricsMiddleware(TaskiqMiddleware):
+    """Observes how long tasks wait in the queue and how long they run."""
+
+    def pre_send(self, message: TaskiqMessage) -> TaskiqMessage:
+        message.labels["enqueued_at"] = time.time()
+        return message
+
+    def pre_execute(self, message: TaskiqMessage) -> TaskiqMessage:
+        enqueued_at = message.labels.get("enqueued_at")
+        if enqueued_at is not None:
+            task_queue_wait_seconds.labels(message.task_name).observe(
+                max(time.time() - float(enqueued_at), 0)
+            )
+        return message
+
+    def post_execute(self, message: TaskiqMessage, result: TaskiqResult) -> None:
+        task_seconds.labels(
+            message.task_name, "error" if result.is_err else "success"
+        ).observe(result.execution_time)
+
+
+def start_worker_metrics_server(port: int, attempts: int = 16) -> int | None:
+    """
+    Serves the metrics of this worker process on the first free port from
+    `port`, as every worker process needs its own. Returns the port.
+    """
+    for candidate in range(port, port + attempts):
+        try:
+            start_http_server(candidate)
+        except OSError:
+            continue
+        logger.info("Serving worker metrics on port %s", candidate)
+        return candidate
+
+    logger.warning("No free port for worker metrics in %s..%s", port, port + attempts - 1)
+    return None
@@ -0,0 +1,81 @@
+import asyncio
+from collections.abc import AsyncIterator, Awaitable, Callable
+from typing import Any
+
+# marks the end of the items in a queue
+_done = object()
+
+
+class _Failed:
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+async def run_pipeline(
+    source: AsyncIterator[Any],
+    stages: list[Callable[[Any], Awaitable[Any]]],
+    maxsize: int = 1,
+):
+    """
+    Feeds the items of `source` through `stages`, every stage running as
+    its own task that works on the next item while the following stage
+    handles the previous one. Stages are connected by queues of `maxsize`
+    items, so a slow stage holds back the ones before it and at most
+    `maxsize` items wait between two stages.
+
+    When a stage fails, the stages before it are cancelled and the stages
+    after it finish the items they already got before the error is raised.
+    Every item that left the last stage was thus handled completely and in
+    order, and nothing after the failed item was.
+    """
+    if maxsize < 1:
+        # an asyncio.Queue of size 0 is unbounded
+        raise ValueError(f"maxsize must be at least 1, got {maxsize}")
+
+    queues = [asyncio.Queue(maxsize) for _ in stages]
+    tasks: list[asyncio.Task] = []
+
+    async def feed():
+        try:
+            async for item in source:
+                await queues[0].put(item)
+        except Exception as error:
+            await queues[0].put(_Failed(error))
+            return
+        await queues[0].put(_done)
+
+    async def run(index: int, stage: Callable[[Any], Awaitable[Any]]):
+        items = queues[index]
+        sink = queues[index + 1] if index + 1 < len(queues) else None
+        while True:
+            item = await items.get()
+            if item is _done or isinstance(item, _Failed):
+                if sink is not None:
+                    await sink.put(item)
+                elif isinstance(item, _Failed):
+                    raise item.error
+                return
+
+            try:
+                result = await stage(item)
+            except Exception as error:
+                # the feeding task comes first, so this cancels the stages
+                # before this one
+                for task in tasks[: index + 1]:
+                    task.cancel()
+                if sink is None:
+                    raise
+                await sink.put(_Failed(error))
+                return
+
+            if sink is not None:
+                await sink.put(result)
+
+    tasks.append(asyncio.create_task(feed()))
+    tasks.extend(asyncio.create_task(run(i, stage)) for i, stage in enumerate(stages))
+    try:
+        await tasks[-1]
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
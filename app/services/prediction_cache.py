@@ -0,0 +1,215 @@
+import hashlib
+import threading
+import unicodedata
+
+from sqlalchemy.engine import Engine
+from sqlmodel import Session, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.dependencies import engine
+from app.models.prediction_cache import PredictionCacheEntry, PredictionCacheStats
+from app.models.sentiment import SentimentPredictLevel
+from app.services.cache import LRUCache
+from app.services.sentiment_predict import SentimentPredict
+from app.services.sql import dialect_insert
+from app.settings import settings
+
+# keep IN (...) lists well below the SQLite bound parameter limit
+_db_chunk_size = 500
+
+
+def normalize_text(value: str) -> str:
+    return " ".join(unicodedata.normalize("NFKC", value).lower().split())
+
+
+def cache_key(normalized: str, model_id: str) -> str:
+    return hashlib.sha256(f"{model_id}\0{normalized}".encode()).hexdigest()
+
+
+class PredictionCache:
+    """
+    Two-tier prediction cache: a bounded in-memory LRU in front of the
+    `predictioncacheentry` table shared by the API and the workers.
+    """
+
+    def __init__(
+        self,
+        engine: Engine,
+        maxsize: int = settings.prediction_cache_size,
+        use_db: bool = settings.prediction_cache_db,
+    ):
+        self.engine = engine
+        self.use_db = use_db
+        self.memory = LRUCache(maxsize)
+        self._lock = threading.Lock()
+        self.memory_hits = 0
+        self.db_hits = 0
+        self.misses = 0
+        self.duplicates = 0
+
+    def get_many(self, keys: list[str]) -> dict[str, SentimentPredictLevel]:
+        found = {}
+        for key in keys:
+            sentiment = self.memory.get(key)
+            if sentiment is not None:
+                found[key] = sentiment
+
+        missing = [key for key in keys if key not in found]
+        from_db = {}
+        if missing and self.use_db:
+            with Session(self.engine) as session:
+                for start in range(0, len(missing), _db_chunk_size):
+                    rows = session.exec(
+                        select(PredictionCacheEntry).where(
+                            PredictionCacheEntry.key.in_(
+                                missing[start : start + _db_chunk_size]
+                            )
+                        )
+                    ).all()
+                    from_db.update((row.key, row.sentiment) for row in rows)
+
+            for key, sentiment in from_db.items():
+                self.memory.set(key, sentiment)
+
+        with self._lock:
+            self.memory_hits += len(found)
+            self.db_hits += len(from_db)
+            self.misses += len(missing) - len(from_db)
+
+        found.update(from_db)
+        return found
+
+    def _inserts(self, bind, items: dict[str, SentimentPredictLevel]) -> list:
+        """Stores `items` in memory and returns the statements storing them in the table."""
+        for key, sentiment in items.items():
+            self.memory.set(key, sentiment)
+
+        if not items or not self.use_db:
+            return []
+
+        rows = [{"key": key, "sentiment": sentiment} for key, sentiment in items.items()]
+        return [
+            dialect_insert(bind, PredictionCacheEntry)
+            .values(rows[start : start + _db_chunk_size])
+            .on_conflict_do_nothing()
+            for start in range(0, len(rows), _db_chunk_size)
+        ]
+
+    def put_many(self, items: dict[str, SentimentPredictLevel]):
+        statements = self._inserts(self.engine, items)
+        if not statements:
+            return
+
+        with Session(self.engine) as session:
+            for statement in statements:
+                session.exec(statement)
+            session.commit()
+
+    async def put_many_async(self, session: AsyncSession, items: dict[str, SentimentPredictLevel]):
+        """`put_many` in the transaction of `session`; the caller commits."""
+        for statement in self._inserts(session.get_bind(), items):
+            await session.exec(statement)
+
+    def record_duplicates(self, count: int):
+        with self._lock:
+            self.duplicates += count
+
+    def stats(self) -> PredictionCacheStats:
+        with self._lock:
+            return PredictionCacheStats(
+                memory_hits=self.memory_hits,
+                db_hits=self.db_hits,
+                misses=self.misses,
+                duplicates=self.duplicates,
+                saved_predictions=self.memory_hits + self.db_hits + self.duplicates,
+            )
+
+
+class PreparedBatch:
+    """Texts looked up in the cache, with the misses tokenized for the model."""
+
+    def __init__(
+        self,
+        keys: list[str],
+        found: dict[str, SentimentPredictLevel],
+        missing: list[str],
+        features: list[dict],
+    ):
+        self.keys = keys
+        self.found = found
+        self.missing = missing
+        self.features = features
+        # sentiments the model predicted, for `store_batch`
+        self.predicted: dict[str, SentimentPredictLevel] = {}
+
+
+class CachedSentimentPredict:
+    """
+    `SentimentPredict` wrapper that scores every distinct normalized text
+    only once and serves repeated texts from a `PredictionCache`.
+    """
+
+    def __init__(self, predictor: SentimentPredict, cache: PredictionCache):
+        self.predictor = predictor
+        self.cache = cache
+
+    def predict(self, value: str) -> SentimentPredictLevel:
+        return self.predict_batch([value])[0]
+
+    def _lookup(self, values: list[str]) -> tuple[list[str], dict, dict[str, str]]:
+        """Cache keys of `values`, the cached sentiments and the texts to predict."""
+        texts_by_key: dict[str, str] = {}
+        keys = []
+        for value in values:
+            normalized = normalize_text(value)
+            key = cache_key(normalized, self.predictor.model_id)
+            texts_by_key.setdefault(key, normalized)
+            keys.append(key)
+
+        self.cache.record_duplicates(len(keys) - len(texts_by_key))
+
+        found = self.cache.get_many(list(texts_by_key))
+        missing = {key: text for key, text in texts_by_key.items() if key not in found}
+        return keys, found, missing
+
+    def predict_batch(self, values: list[str]) -> list[SentimentPredictLevel]:
+        keys, found, missing = self._lookup(values)
+        if missing:
+            predicted = dict(
+                zip(missing, self.predictor.predict_batch(list(missing.values())))
+            )
+            self.cache.put_many(predicted)
+            found.update(predicted)
+
+        return [found[key] for key in keys]
+
+    def prepare_batch(self, values: list[str]) -> PreparedBatch:
+        """
+        First half of `predict_batch`: the cache lookups and the tokenization
+        of the texts the model has to score. A pipeline can prepare the next
+        batch while `finish_batch` runs the model on this one.
+        """
+        keys, found, missing = self._lookup(values)
+        features = self.predictor.tokenize(list(missing.values())) if missing else []
+        return PreparedBatch(keys, found, list(missing), features)
+
+    def finish_batch(self, batch: PreparedBatch) -> list[SentimentPredictLevel]:
+        """
+        Second half of `predict_batch`: the forward pass over a prepared
+        batch. The new predictions are only cached by `store_batch`, so the
+        thread running the model doesn't wait on the database.
+        """
+        if batch.missing:
+            batch.predicted = dict(
+                zip(batch.missing, self.predictor.predict_features(batch.features))
+            )
+            batch.found.update(batch.predicted)
+
+        return [batch.found[key] for key in batch.keys]
+
+    async def store_batch(self, session: AsyncSession, batch: PreparedBatch):
+        """Caches the predictions of a finished batch in the transaction of `session`."""
+        await self.cache.put_many_async(session, batch.predicted)
+
+
+prediction_cache = PredictionCache(engine)
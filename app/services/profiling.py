@@ -0,0 +1,122 @@
+"""
+Opt-in profiling of single requests with pyinstrument.
+
+A request is profiled when its `settings.profile_header` header carries
+`settings.profile_secret` or it is drawn at `settings.profile_sample_rate`;
+its profile is written as an HTML report to `settings.profile_dir`, which
+keeps the newest `settings.profile_max_files` reports. The profiler follows
+the request on the event loop and into sync endpoints run in the
+threadpool.
+"""
+
+import hmac
+import logging
+import random
+import re
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from pathlib import Path
+
+from app.settings import settings
+
+logger = logging.getLogger(__name__)
+
+
+class RequestProfile:
+    def __init__(self):
+        # sessions of the threadpool threads the request ran code in
+        self.thread_sessions = []
+
+
+_profile: ContextVar[RequestProfile | None] = ContextVar("request_profile", default=None)
+
+
+def should_profile(scope) -> bool:
+    # checked before authentication, so the header alone must not be enough
+    # to make anyone's requests slower and fill the disk
+    if settings.profile_header and settings.profile_secret:
+        header = settings.profile_header.lower().encode()
+        secret = settings.profile_secret.encode()
+        if any(
+            name == header and hmac.compare_digest(value, secret)
+            for name, value in scope["headers"]
+        ):
+            return True
+    return random.random() < settings.profile_sample_rate
+
+
+def profile_path(scope) -> Path:
+    path = re.sub(r"[^A-Za-z0-9]+", "-", scope["path"]).strip("-") or "root"
+    name = f"{datetime.now():%Y%m%dT%H%M%S%f}-{scope['method']}-{path}.html"
+    return Path(settings.profile_dir) / name
+
+
+@contextmanager
+def request_profile(scope):
+    """Profiles the wrapped request if it was selected for profiling."""
+    if not should_profile(scope):
+        yield
+        return
+
+    # only imported when profiling is actually used
+    from pyinstrument import Profiler
+
+    profiler = Profiler(async_mode="enabled")
+    try:
+        profiler.start()
+    except RuntimeError:
+        # another profiler is already running on this thread
+        logger.warning("Skipping profile of %s, profiler busy", scope["path"])
+        yield
+        return
+
+    profile = RequestProfile()
+    token = _profile.set(profile)
+    try:
+        yield
+    finally:
+        _profile.reset(token)
+        session = profiler.stop()
+        write_profile(profile_path(scope), session, profile.thread_sessions)
+
+
+@contextmanager
+def thread_profile():
+    """Profiles code a profiled request runs in a threadpool thread."""
+    profile = _profile.get()
+    if profile is None:
+        yield
+        return
+
+    from pyinstrument import Profiler
+
+    profiler = Profiler(async_mode="disabled")
+    profiler.start()
+    try:
+        yield
+    finally:
+        profile.thread_sessions.append(profiler.stop())
+
+
+def write_profile(path: Path, session, thread_sessions: list):
+    from pyinstrument.renderers import HTMLRenderer
+    from pyinstrument.session import Session
+
+    for thread_session in thread_sessions:
+        session = Session.combine(session, thread_session)
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(HTMLRenderer().render(session), encoding="utf-8")
+    logger.info("Wrote request profile to %s", path)
+    prune_profiles(path.parent)
+
+
+def prune_profiles(directory: Path):
+    """Deletes all but the newest `settings.profile_max_files` reports."""
+    if settings.profile_max_files <= 0:
+        return
+    # names start with the time they were written
+    profiles = sorted(directory.glob("*.html"))
+    for path in profiles[: -settings.profile_max_files]:
+        path.unlink(missing_ok=True)
@@ -0,0 +1,154 @@
+import asyncio
+import threading
+from collections import defaultdict
+from collections.abc import AsyncIterator
+from contextlib import asynccontextmanager
+
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.dependencies import async_engine
+from app.models.upload import Upload, UploadProgress
+from app.settings import settings
+
+
+async def load_progress(engine: AsyncEngine, upload_id: int) -> UploadProgress | None:
+    async with AsyncSession(engine) as session:
+        row = (
+            await session.exec(
+                select(Upload.status, Upload.entries_done, Upload.entries_total).where(
+                    Upload.id == upload_id
+                )
+            )
+        ).first()
+    if row is None:
+        return None
+
+    status, done, total = row
+    return UploadProgress(
+        upload_id=upload_id, status=status, entries_done=done, entries_total=total
+    )
+
+
+class DatabaseProgressChannel:
+    """
+    Progress read from the counters the worker commits on `Upload`, so it
+    works across processes without extra infrastructure. Publishing is a
+    no-op; subscribers poll one row every `interval` seconds.
+
+    Every channel has `publish(progress)`, `subscribe(upload_id)` (an async
+    context manager giving an object with `async next()`) and the `engine`
+    the current state is read from.
+    """
+
+    def __init__(self, engine: AsyncEngine, interval: float = settings.progress_poll_interval):
+        self.engine = engine
+        self.interval = interval
+
+    async def publish(self, progress: UploadProgress):
+        pass
+
+    @asynccontextmanager
+    async def subscribe(self, upload_id: int) -> AsyncIterator["DatabaseSubscription"]:
+        yield DatabaseSubscription(self, upload_id)
+
+
+class DatabaseSubscription:
+    def __init__(self, channel: DatabaseProgressChannel, upload_id: int):
+        self.channel = channel
+        self.upload_id = upload_id
+        self.last: UploadProgress | None = None
+
+    async def next(self) -> UploadProgress:
+        while True:
+            progress = await load_progress(self.channel.engine, self.upload_id)
+            if progress is None:
+                raise LookupError(f"Upload {self.upload_id} not found")
+            if progress != self.last:
+                self.last = progress
+                return progress
+            await asyncio.sleep(self.channel.interval)
+
+
+class MemoryProgressChannel:
+    """
+    In-process channel for a worker running next to the API (the in-memory
+    broker, tests). `publish` may be called from any thread or event loop.
+    """
+
+    def __init__(self, engine: AsyncEngine):
+        self.engine = engine
+        self._subscribers: dict[int, set[tuple]] = defaultdict(set)
+        self._lock = threading.Lock()
+
+    async def publish(self, progress: UploadProgress):
+        with self._lock:
+            subscribers = list(self._subscribers.get(progress.upload_id, ()))
+        for loop, queue in subscribers:
+            loop.call_soon_threadsafe(queue.put_nowait, progress)
+
+    @asynccontextmanager
+    async def subscribe(self, upload_id: int) -> AsyncIterator["MemorySubscription"]:
+        subscriber = (asyncio.get_running_loop(), asyncio.Queue())
+        with self._lock:
+            self._subscribers[upload_id].add(subscriber)
+        try:
+            yield MemorySubscription(subscriber[1])
+        finally:
+            with self._lock:
+                self._subscribers[upload_id].discard(subscriber)
+                if not self._subscribers[upload_id]:
+                    del self._subscribers[upload_id]
+
+
+class MemorySubscription:
+    def __init__(self, queue: asyncio.Queue):
+        self.queue = queue
+
+    async def next(self) -> UploadProgress:
+        return await self.queue.get()
+
+
+def format_event(progress: UploadProgress) -> str:
+    return f"event: progress\ndata: {progress.model_dump_json()}\n\n"
+
+
+async def progress_events(
+    channel: DatabaseProgressChannel | MemoryProgressChannel,
+    upload_id: int,
+    keepalive: float = settings.progress_keepalive,
+) -> AsyncIterator[str]:
+    """
+    Server-sent events for an upload: its current progress, then every
+    change until it is READY or ERROR. A comment is sent after `keepalive`
+    idle seconds so proxies don't close the connection.
+    """
+    async with channel.subscribe(upload_id) as subscription:
+        # read after subscribing, so no update published in between is lost
+        progress = await load_progress(channel.engine, upload_id)
+        if progress is None:
+            return
+        yield format_event(progress)
+
+        while not progress.finished:
+            try:
+                progress = await asyncio.wait_for(subscription.next(), keepalive)
+            except TimeoutError:
+                yield ": keep-alive\n\n"
+                continue
+            except LookupError:
+                return
+            yield format_event(progress)
+
+
+progress_channels = {
+    "db": lambda: DatabaseProgressChannel(async_engine),
+    "memory": lambda: MemoryProgressChannel(async_engine),
+}
+
+progress_channel = progress_channels[settings.progress_channel]()
+
+
+def get_progress_channel() -> DatabaseProgressChannel | MemoryProgressChannel:
+    return progress_channel
@@ -0,0 +1,14 @@
+from app.settings import settings
+
+# RabbitMQ only orders messages by priority on a queue declared with
+# x-max-priority, one level per lane
+max_priority = len(settings.priority_lanes)
+
+
+def task_priority(entries: int) -> int:
+    """
+    Priority of the tasks of an upload with `entries` entries: one level
+    for every lane limit it stays within, so the smallest uploads are
+    picked up first and the largest ones get priority 0.
+    """
+    return sum(entries <= limit for limit in settings.priority_lanes)
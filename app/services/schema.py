@@ -0,0 +1,81 @@
+"""
+Brings an existing database up to the current models on startup.
+
+`SQLModel.metadata.create_all` creates missing tables, with their indexes,
+but never changes a table that exists. `upgrade_schema` also adds the
+columns and indexes existing tables are missing, and on PostgreSQL the
+values missing from enum types. Every step checks the live schema first,
+so it is safe to run from every process on every start. Columns are only
+added, never changed or dropped.
+"""
+
+import logging
+
+from sqlalchemy import Enum, inspect, literal
+from sqlalchemy.engine import Engine
+from sqlalchemy.schema import Column, Table
+from sqlmodel import SQLModel
+
+logger = logging.getLogger(__name__)
+
+
+def add_column_ddl(engine: Engine, table: Table, column: Column) -> str:
+    dialect = engine.dialect
+    quote = dialect.identifier_preparer.quote
+    # another process starting at the same time may add it first
+    if_not_exists = " IF NOT EXISTS" if dialect.name == "postgresql" else ""
+    ddl = (
+        f"ALTER TABLE {quote(table.name)} ADD COLUMN{if_not_exists} {quote(column.name)} "
+        f"{column.type.compile(dialect=dialect)}"
+    )
+
+    # existing rows get the model default; without one the column can only
+    # be added as nullable
+    default = column.default
+    if default is not None and default.is_scalar:
+        value = literal(default.arg, column.type).compile(
+            dialect=dialect, compile_kwargs={"literal_binds": True}
+        )
+        ddl += f" DEFAULT {value}"
+        if not column.nullable:
+            ddl += " NOT NULL"
+    return ddl
+
+
+def upgrade_schema(engine: Engine, metadata=SQLModel.metadata):
+    metadata.create_all(engine)
+
+    inspector = inspect(engine)
+    with engine.begin() as connection:
+        for table in metadata.sorted_tables:
+            columns = {column["name"] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in columns:
+                    logger.info("Adding column %s.%s", table.name, column.name)
+                    connection.exec_driver_sql(add_column_ddl(engine, table, column))
+
+            indexes = {index["name"] for index in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in indexes:
+                    logger.info("Creating index %s", index.name)
+                    index.create(connection)
+
+    if engine.dialect.name == "postgresql":
+        _add_enum_values(engine, metadata)
+
+
+def _add_enum_values(engine: Engine, metadata):
+    enums = {
+        column.type.name: column.type
+        for table in metadata.sorted_tables
+        for column in table.columns
+        if isinstance(column.type, Enum) and column.type.native_enum and column.type.name
+    }
+    # a value added inside a transaction can't be used before it commits
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+        quote = engine.dialect.identifier_preparer.quote
+        for name, type in enums.items():
+            for value in type.enums:
+                connection.exec_driver_sql(
+                    f"ALTER TYPE {quote(name)} ADD VALUE IF NOT EXISTS '{value}'"
+                )
@@ -1,47 +1,231 @@
-from enum import Enum
+import threading
 
 import numpy as np
-import torch
-from transformers import AutoModelForSequenceClassification, AutoTokenizer
 
+from app.models.sentiment import (
+    ChunkPrediction,
+    DocumentPrediction,
+    SentimentPredictLevel,
+    mapper,
+)
+from app.services.inference_backends import TorchBackend, backends
+from app.services.metrics import (
+    predict_batch_size,
+    predict_forward_seconds,
+    predict_tokenize_seconds,
+    predict_tokens,
+)
+from app.settings import settings
 
-class SentimentPredictLevel(str, Enum):
-    VERY_NEGATIVE = "very_negative"
-    NEGATIVE = "negative"
-    NEUTRAL = "neutral"
-    POSITIVE = "positive"
-    VERY_POSITIVE = "very_positive"
+model_name = "tabularisai/robust-sentiment-analysis"
+max_length = 512
 
+_tokenizer = None
+_model = None
+_backends = {}
+_load_lock = threading.Lock()
+# the fast tokenizer can't be used from two threads at once when the calls
+# differ in their truncation settings ("Already borrowed"), which happens
+# when the worker tokenizes a batch while long documents of the previous
+# one are scored
+_tokenizer_lock = threading.Lock()
 
-mapper = {
-    0: SentimentPredictLevel.VERY_NEGATIVE,
-    1: SentimentPredictLevel.NEGATIVE,
-    2: SentimentPredictLevel.NEUTRAL,
-    3: SentimentPredictLevel.POSITIVE,
-    4: SentimentPredictLevel.VERY_POSITIVE,
-}
 
-model_name = "tabularisai/robust-sentiment-analysis"
+def load_model(backend: str | None = None):
+    """
+    Loads the tokenizer and the inference backend on first use.
+
+    torch and transformers are imported only from here and the backends, so
+    processes that never run inference (CRUD-only API replicas, tests) don't
+    pay for them.
+    """
+    global _tokenizer, _model
+
+    backend = backend or settings.inference_backend
+    if backend not in backends:
+        raise ValueError(f"Unknown inference backend: {backend}")
+
+    if backend not in _backends:
+        with _load_lock:
+            if _model is None:
+                from transformers import (
+                    AutoModelForSequenceClassification,
+                    AutoTokenizer,
+                )
+
+                _tokenizer = AutoTokenizer.from_pretrained(model_name)
+                model = AutoModelForSequenceClassification.from_pretrained(model_name)
+                model.eval()
+                _model = model
+
+            if backend not in _backends:
+                _backends[backend] = backends[backend](_model, _tokenizer)
+
+    return _tokenizer, _backends[backend]
 
-tokenizer = AutoTokenizer.from_pretrained(model_name)
-model = AutoModelForSequenceClassification.from_pretrained(model_name)
+
+def pad_features(features: list[dict], pad_token_id: int) -> dict[str, np.ndarray]:
+    """Right-pads tokenized features to the longest sequence among them."""
+    longest = max(len(feature["input_ids"]) for feature in features)
+
+    inputs = {}
+    for key in features[0]:
+        pad_value = pad_token_id if key == "input_ids" else 0
+        array = np.full((len(features), longest), pad_value, dtype=np.int64)
+        for row, feature in enumerate(features):
+            array[row, : len(feature[key])] = feature[key]
+        inputs[key] = array
+    return inputs
 
 
 class SentimentPredict:
+    def __init__(self, backend: str | None = None):
+        self.backend = backend or settings.inference_backend
+
+    @property
+    def model_id(self) -> str:
+        # quantized engines may disagree with the torch baseline, so they get
+        # their own cache keys
+        if self.backend == TorchBackend.name:
+            return model_name
+        return f"{model_name}:{self.backend}"
+
+    def warm_up(self):
+        load_model(self.backend)
+        self.predict("warm up")
+
     def predict(self, value: str) -> SentimentPredictLevel:
-        inputs = tokenizer(
-            value.lower(),
-            return_tensors="pt",
-            truncation=True,
-            padding=True,
-            max_length=512,
-        )
-        
-        with torch.no_grad():
-            outputs = model(**inputs)
-
-        probabilities = torch.nn.functional.softmax(outputs.logits, dim=-1)
-        probabilities_np = probabilities.numpy()
-        predicted_class = np.argmax(probabilities_np, axis=-1)
-
-        return mapper[predicted_class[0]]
+        return self.predict_batch([value])[0]
+
+    def predict_batch(
+        self, values: list[str], batch_size: int | None = None
+    ) -> list[SentimentPredictLevel]:
+        """
+        Predicts sentiment for many texts at once. Texts longer than the
+        model window are truncated, see `predict_documents` for long texts.
+        Results are returned in the order of `values`.
+        """
+        return self.predict_features(self.tokenize(values), batch_size)
+
+    def tokenize(self, values: list[str]) -> list[dict]:
+        """
+        Model features of `values`, truncated to the model window. The fast
+        tokenizer releases the GIL, so this can run in a thread next to a
+        forward pass.
+        """
+        if not values:
+            return []
+
+        tokenizer, _ = load_model(self.backend)
+        with _tokenizer_lock, predict_tokenize_seconds.labels(self.backend).time():
+            encodings = tokenizer(
+                [value.lower() for value in values],
+                truncation=True,
+                max_length=max_length,
+            )
+        return [
+            {key: encodings[key][i] for key in encodings.keys()}
+            for i in range(len(values))
+        ]
+
+    def predict_features(
+        self, features: list[dict], batch_size: int | None = None
+    ) -> list[SentimentPredictLevel]:
+        """Predicts sentiment for features from `tokenize`, in their order."""
+        if not features:
+            return []
+
+        logits = self._logits(features, batch_size)
+        return [mapper[predicted_class] for predicted_class in logits.argmax(axis=-1).tolist()]
+
+    def predict_documents(
+        self,
+        values: list[str],
+        stride: int | None = None,
+        batch_size: int | None = None,
+    ) -> list[DocumentPrediction]:
+        """
+        Predicts sentiment for long texts without truncating them.
+
+        Every text is split into overlapping windows of `max_length` tokens
+        sharing `stride` tokens with the previous window. Windows of all texts
+        are scored together, and a text's label is the average of its window
+        probabilities weighted by the number of tokens in each window.
+        """
+        if not values:
+            return []
+
+        tokenizer, _ = load_model(self.backend)
+        with _tokenizer_lock, predict_tokenize_seconds.labels(self.backend).time():
+            encodings = tokenizer(
+                [value.lower() for value in values],
+                truncation=True,
+                max_length=max_length,
+                stride=stride if stride is not None else settings.long_document_stride,
+                return_overflowing_tokens=True,
+                return_offsets_mapping=True,
+            )
+        model_inputs = tokenizer.model_input_names
+        features = [
+            {key: encodings[key][i] for key in model_inputs if key in encodings}
+            for i in range(len(encodings["input_ids"]))
+        ]
+
+        logits = self._logits(features, batch_size)
+        probabilities = np.exp(logits - logits.max(axis=-1, keepdims=True))
+        probabilities /= probabilities.sum(axis=-1, keepdims=True)
+
+        chunks_by_value: list[list[int]] = [[] for _ in values]
+        for chunk, value_index in enumerate(encodings["overflow_to_sample_mapping"]):
+            chunks_by_value[value_index].append(chunk)
+
+        results = []
+        for chunks in chunks_by_value:
+            weights = np.array([sum(features[chunk]["attention_mask"]) for chunk in chunks])
+            document_probabilities = (probabilities[chunks] * weights[:, None]).sum(axis=0)
+
+            chunk_predictions = []
+            for chunk in chunks:
+                # special tokens have (0, 0) offsets
+                offsets = [
+                    offset for offset in encodings["offset_mapping"][chunk] if offset[1] > 0
+                ]
+                chunk_predictions.append(
+                    ChunkPrediction(
+                        start=offsets[0][0] if offsets else 0,
+                        end=offsets[-1][1] if offsets else 0,
+                        sentiment=mapper[int(probabilities[chunk].argmax())],
+                    )
+                )
+
+            results.append(
+                DocumentPrediction(
+                    sentiment=mapper[int(document_probabilities.argmax())],
+                    chunks=chunk_predictions,
+                )
+            )
+
+        return results
+
+    def _logits(self, features: list[dict], batch_size: int | None = None) -> np.ndarray:
+        """
+        Runs the model over tokenized features. Features are sorted by token
+        length and split into batches, so every batch is padded only to its
+        own longest sequence. Logits are returned in the order of `features`.
+        """
+        tokenizer, backend = load_model(self.backend)
+        batch_size = batch_size or settings.predict_batch_size
+
+        order = sorted(range(len(features)), key=lambda i: len(features[i]["input_ids"]))
+
+        logits = np.empty((len(features), len(mapper)), dtype=np.float32)
+        for start in range(0, len(order), batch_size):
+            bucket = order[start : start + batch_size]
+            inputs = pad_features([features[i] for i in bucket], tokenizer.pad_token_id)
+            with predict_forward_seconds.labels(self.backend).time():
+                logits[bucket] = backend.logits(inputs)
+
+            predict_batch_size.labels(self.backend).observe(len(bucket))
+            predict_tokens.labels(self.backend).inc(int(inputs["attention_mask"].sum()))
+
+        return logits
@@ -0,0 +1,32 @@
+from sqlalchemy import Insert, insert, make_url
+from sqlalchemy.engine import Connection, Engine
+
+_async_drivers = {"postgresql": "asyncpg", "sqlite": "aiosqlite"}
+
+
+def dialect_insert(bind: Engine | Connection, table) -> Insert:
+    """
+    Returns an INSERT construct for `table` that supports `ON CONFLICT`
+    clauses on PostgreSQL and SQLite.
+    """
+    if bind.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+        return pg_insert(table)
+    if bind.dialect.name == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+        return sqlite_insert(table)
+    return insert(table)
+
+
+def async_database_url(url: str) -> str:
+    """
+    Maps a database URL for a sync driver (`postgresql://`, `sqlite://`) to
+    the same database behind its asyncio driver.
+    """
+    url = make_url(url)
+    driver = _async_drivers.get(url.get_backend_name())
+    if driver and url.get_driver_name() != driver:
+        url = url.set(drivername=f"{url.get_backend_name()}+{driver}")
+    return url.render_as_string(hide_password=False)
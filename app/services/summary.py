@@ -0,0 +1,33 @@
+from collections import Counter
+
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.models.upload import UploadEntry, UploadSummary
+from app.services.sql import dialect_insert
+
+
+async def count_sentiments(session: AsyncSession, upload_id: int, entries: list[UploadEntry]):
+    """
+    Adds the sentiments of freshly scored `entries` to the upload's summary
+    counts. Runs in the transaction that stores the sentiments, so the
+    summary matches the committed entries.
+    """
+    counts = Counter(
+        (entry.description or "", entry.sentiment)
+        for entry in entries
+        if entry.sentiment is not None
+    )
+    if not counts:
+        return
+
+    statement = dialect_insert(session.get_bind(), UploadSummary)
+    await session.exec(
+        statement.on_conflict_do_update(
+            index_elements=[UploadSummary.upload_id, UploadSummary.question, UploadSummary.sentiment],
+            set_={"count": UploadSummary.count + statement.excluded.count},
+        ),
+        params=[
+            {"upload_id": upload_id, "question": question, "sentiment": sentiment, "count": count}
+            for (question, sentiment), count in counts.items()
+        ],
+    )
@@ -0,0 +1,150 @@
+"""
+Per-request phase timings, sent back in a `Server-Timing` header.
+
+Code that wants its time reported wraps it in `phase(name)`; database time
+is added by the query listeners in `app.services.metrics`. Phases may
+overlap, e.g. the user upsert counts towards both `auth` and `db`.
+"""
+
+import asyncio
+import functools
+import time
+from collections.abc import Callable
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from fastapi.routing import APIRoute
+
+from app.services import profiling
+from app.settings import settings
+
+
+class RequestTimings:
+    def __init__(self):
+        self.phases: dict[str, float] = {}
+        self.counts: dict[str, int] = {}
+        self.endpoint_done_at: float | None = None
+
+    def add(self, name: str, seconds: float):
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+        self.counts[name] = self.counts.get(name, 0) + 1
+
+    def header(self, total: float) -> str:
+        entries = []
+        for name, seconds in self.phases.items():
+            entry = f"{name};dur={seconds * 1000:.1f}"
+            if name == "db":
+                entry += f';desc="{self.counts[name]} queries"'
+            entries.append(entry)
+        entries.append(f"total;dur={total * 1000:.1f}")
+        return ", ".join(entries)
+
+
+# shared with the threadpool and tasks a request spawns, which run on a
+# copy of its context
+_timings: ContextVar[RequestTimings | None] = ContextVar("request_timings", default=None)
+
+
+def add_timing(name: str, seconds: float):
+    timings = _timings.get()
+    if timings is not None:
+        timings.add(name, seconds)
+
+
+@contextmanager
+def phase(name: str):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_timing(name, time.perf_counter() - start)
+
+
+def _timed_endpoint(endpoint: Callable) -> Callable:
+    # FastAPI serializes the response right after the endpoint returns, so
+    # the time from there until the handler is done is `serialize`
+    def done():
+        timings = _timings.get()
+        if timings is not None:
+            timings.endpoint_done_at = time.perf_counter()
+
+    if getattr(endpoint, "_timed", False):
+        # routes are copied, with their endpoint, into every including router
+        return endpoint
+
+    if asyncio.iscoroutinefunction(endpoint):
+
+        @functools.wraps(endpoint)
+        async def timed(*args, **kwargs):
+            try:
+                return await endpoint(*args, **kwargs)
+            finally:
+                done()
+
+    else:
+
+        @functools.wraps(endpoint)
+        def timed(*args, **kwargs):
+            # sync endpoints run in the threadpool, out of the request's
+            # profiler's sight
+            with profiling.thread_profile():
+                try:
+                    return endpoint(*args, **kwargs)
+                finally:
+                    done()
+
+    timed._timed = True
+    return timed
+
+
+class TimedRoute(APIRoute):
+    """Route class that reports the `serialize` phase of its responses."""
+
+    def __init__(self, path: str, endpoint: Callable, **kwargs):
+        super().__init__(path, _timed_endpoint(endpoint), **kwargs)
+
+    def get_route_handler(self):
+        handler = super().get_route_handler()
+
+        async def timed_handler(request):
+            response = await handler(request)
+            timings = _timings.get()
+            if timings is not None and timings.endpoint_done_at is not None:
+                timings.add("serialize", time.perf_counter() - timings.endpoint_done_at)
+            return response
+
+        return timed_handler
+
+
+class ServerTimingMiddleware:
+    """
+    ASGI middleware collecting the phases of every request into a
+    `Server-Timing` header and profiling the requests `profiling` selects.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timings = RequestTimings()
+        token = _timings.set(timings)
+        start = time.perf_counter()
+
+        async def send_with_timings(message):
+            if message["type"] == "http.response.start" and settings.server_timing:
+                header = timings.header(time.perf_counter() - start)
+                message["headers"] = [
+                    *message.get("headers", []),
+                    (b"server-timing", header.encode()),
+                ]
+            await send(message)
+
+        try:
+            with profiling.request_profile(scope):
+                await self.app(scope, receive, send_with_timings)
+        finally:
+            _timings.reset(token)
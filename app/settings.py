@@ -3,9 +3,51 @@ import os
 
 class Settings:
     database_url: str = os.getenv("DATABASE_URL", "sqlite:///database.db")
+    async_database_url: str | None = os.getenv("ASYNC_DATABASE_URL")
+    db_pool_size: int = int(os.getenv("DB_POOL_SIZE", "10"))
+    db_max_overflow: int = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+    db_pool_timeout: float = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+    db_pool_recycle: int = int(os.getenv("DB_POOL_RECYCLE", "1800"))
     oidc_base_url: str = os.getenv("OIDC_BASE_URL", "https://lemur-15.cloud-iam.com/auth/realms/sentiment-analyzer")
     rabbit_mq_url: str = os.environ["RABBIT_MQ_URL"]
     rabbit_queue: str = os.environ["RABBIT_MQ_QUEUE"]
+    inference_backend: str = os.getenv("INFERENCE_BACKEND", "torch")
+    onnx_model_path: str = os.getenv("ONNX_MODEL_PATH", "models/robust-sentiment-analysis.onnx")
+    predict_warmup: bool = os.getenv("PREDICT_WARMUP", "false").lower() == "true"
+    jwks_cache_ttl: float = float(os.getenv("JWKS_CACHE_TTL", "300"))
+    jwks_fetch_timeout: float = float(os.getenv("JWKS_FETCH_TIMEOUT", "5"))
+    token_cache_size: int = int(os.getenv("TOKEN_CACHE_SIZE", "10000"))
+    user_cache_size: int = int(os.getenv("USER_CACHE_SIZE", "10000"))
+    access_cache_size: int = int(os.getenv("ACCESS_CACHE_SIZE", "10000"))
+    access_cache_ttl: float = float(os.getenv("ACCESS_CACHE_TTL", "5"))
+    predict_batch_size: int = int(os.getenv("PREDICT_BATCH_SIZE", "32"))
+    long_document_mode: bool = os.getenv("LONG_DOCUMENT_MODE", "true").lower() == "true"
+    long_document_stride: int = int(os.getenv("LONG_DOCUMENT_STRIDE", "128"))
+    ingest_batch_size: int = int(os.getenv("INGEST_BATCH_SIZE", "5000"))
+    export_batch_size: int = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+    upload_shard_size: int = int(os.getenv("UPLOAD_SHARD_SIZE", "5000"))
+    process_batch_size: int = int(os.getenv("PROCESS_BATCH_SIZE", "256"))
+    # asyncio queues of size 0 are unbounded
+    pipeline_depth: int = max(1, int(os.getenv("PIPELINE_DEPTH", "2")))
+    priority_lanes: list[int] = [
+        int(limit) for limit in os.getenv("PRIORITY_LANES", "1000,10000,100000").split(",") if limit
+    ]
+    owner_max_shards: int = int(os.getenv("OWNER_MAX_SHARDS", "4"))
+    upload_max_retries: int = int(os.getenv("UPLOAD_MAX_RETRIES", "3"))
+    progress_channel: str = os.getenv("PROGRESS_CHANNEL", "db")
+    progress_poll_interval: float = float(os.getenv("PROGRESS_POLL_INTERVAL", "1"))
+    progress_keepalive: float = float(os.getenv("PROGRESS_KEEPALIVE", "15"))
+    worker_metrics_port: int = int(os.getenv("WORKER_METRICS_PORT", "9100"))
+    server_timing: bool = os.getenv("SERVER_TIMING", "true").lower() == "true"
+    profile_sample_rate: float = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+    profile_header: str = os.getenv("PROFILE_HEADER", "")
+    profile_secret: str = os.getenv("PROFILE_SECRET", "")
+    profile_dir: str = os.getenv("PROFILE_DIR", "profiles")
+    profile_max_files: int = int(os.getenv("PROFILE_MAX_FILES", "100"))
+    check_batch_max_size: int = int(os.getenv("CHECK_BATCH_MAX_SIZE", "64"))
+    check_batch_max_wait_ms: float = float(os.getenv("CHECK_BATCH_MAX_WAIT_MS", "5"))
+    prediction_cache_size: int = int(os.getenv("PREDICTION_CACHE_SIZE", "10000"))
+    prediction_cache_db: bool = os.getenv("PREDICTION_CACHE_DB", "true").lower() == "true"
 
 
 settings = Settings()
@@ -0,0 +1,85 @@
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import NullPool
+from sqlmodel import SQLModel
+
+from app.models.sentiment import ChunkPrediction, DocumentPrediction, SentimentPredictLevel
+
+
+class FakePredict:
+    """
+    Stands in for the model: texts containing "bad" or "fail" are negative,
+    everything else is positive. Every batch it scores is kept in `calls`.
+    """
+
+    model_id = "fake-model"
+
+    def __init__(self):
+        self.calls: list[list[str]] = []
+
+    def predict_batch(self, values: list[str]) -> list[SentimentPredictLevel]:
+        self.calls.append(values)
+        return [
+            SentimentPredictLevel.NEGATIVE
+            if "bad" in value or "fail" in value
+            else SentimentPredictLevel.POSITIVE
+            for value in values
+        ]
+
+    @property
+    def predictor(self) -> "FakePredict":
+        return self
+
+    def predict_documents(self, values: list[str]) -> list[DocumentPrediction]:
+        # two chunks per document, split in the middle
+        return [
+            DocumentPrediction(
+                sentiment=SentimentPredictLevel.POSITIVE,
+                chunks=[
+                    ChunkPrediction(
+                        start=0, end=len(value) // 2, sentiment=SentimentPredictLevel.POSITIVE
+                    ),
+                    ChunkPrediction(
+                        start=len(value) // 2,
+                        end=len(value),
+                        sentiment=SentimentPredictLevel.NEGATIVE,
+                    ),
+                ],
+            )
+            for value in values
+        ]
+
+    # the worker pipeline splits predict_batch into two stages
+    def prepare_batch(self, values: list[str]) -> list[str]:
+        return values
+
+    def finish_batch(self, values: list[str]) -> list[SentimentPredictLevel]:
+        return self.predict_batch(values)
+
+    async def store_batch(self, session, values: list[str]):
+        pass
+
+
+@pytest.fixture(name="predictor")
+def predictor_fixture() -> FakePredict:
+    return FakePredict()
+
+
+@pytest.fixture(name="database_path")
+def database_path_fixture(tmp_path):
+    # sync and async code reach the same database through different
+    # drivers, so it can't be in-memory
+    path = tmp_path / "test.db"
+    SQLModel.metadata.create_all(create_engine(f"sqlite:///{path}"))
+    return path
+
+
+@pytest.fixture(name="engine")
+def engine_fixture(database_path):
+    return create_engine(f"sqlite:///{database_path}")
+
+
+@pytest.fixture(name="async_engine")
+def async_engine_fixture(database_path):
+    return create_async_engine(f"sqlite+aiosqlite:///{database_path}", poolclass=NullPool)
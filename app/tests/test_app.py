@@ -1,26 +1,76 @@
+import asyncio
 import datetime
+import io
+import json
+import subprocess
+import sys
+import threading
+import time
+
+import docx
+import openpyxl
 
 import pytest
 from fastapi.testclient import TestClient
+from prometheus_client import REGISTRY
 from sqlalchemy import create_engine
-from sqlmodel import Session, SQLModel
-from sqlmodel.pool import StaticPool
+from sqlmodel import Session
+from sqlmodel.ext.asyncio.session import AsyncSession
 
-from app.dependencies import get_oidc_keycloak_user, get_session
+from app.dependencies import (
+    access_cache,
+    get_async_session,
+    get_oidc_keycloak_user,
+    get_session,
+    user_cache,
+)
 from app.main import app
 from app.models.keycloak import KeycloakIDToken
+from app.models.sentiment import SentimentPredictLevel
+from app.models.upload import UploadProgress, UploadStatus, UploadSummary
+from app.models.user import User
+from app.routes import uploads as upload_routes
+from app.services.progress import MemoryProgressChannel, get_progress_channel
+from app.settings import settings
+
+
+@pytest.fixture(autouse=True)
+def clear_caches():
+    # every test gets a fresh database, so nothing cached for it may leak
+    user_cache.clear()
+    access_cache.clear()
+    yield
+
+
+@pytest.fixture(autouse=True)
+def kicked_uploads(monkeypatch):
+    # the API tests don't run the worker, that is covered in test_broker.py
+    kicked = []
+
+    async def kick_upload(upload_id: int, entries: int):
+        kicked.append(upload_id)
+
+    monkeypatch.setattr(upload_routes, "kick_upload", kick_upload)
+    return kicked
 
 
 @pytest.fixture(name="session")
-def session_fixture():
-    engine = create_engine(
-        "sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool
-    )
-    SQLModel.metadata.create_all(engine)
-    with Session(engine) as session:
+def session_fixture(database_path):
+    with Session(create_engine(f"sqlite:///{database_path}")) as session:
         yield session
 
 
+@pytest.fixture(autouse=True)
+def async_session_override(async_engine):
+    async def get_async_session_override():
+        async with AsyncSession(async_engine, expire_on_commit=False) as session:
+            yield session
+
+    app.dependency_overrides[get_async_session] = get_async_session_override
+    yield
+    app.dependency_overrides.clear()
+
+
 @pytest.fixture(name="client")
 def client_fixture(session: Session):
     def get_session_override():
@@ -29,7 +79,6 @@ def client_fixture(session: Session):
     app.dependency_overrides[get_session] = get_session_override
     client = TestClient(app)
     yield client
-    app.dependency_overrides.clear()
 
 
 @pytest.fixture(name="client_authorized")
@@ -52,7 +101,6 @@ def client_authorized_fixture(session: Session):
     app.dependency_overrides[get_oidc_keycloak_user] = get_oidc_keycloak_user_override
     client = TestClient(app)
     yield client
-    app.dependency_overrides.clear()
 
 
 def test_read_main(client: TestClient):
@@ -84,6 +132,29 @@ def test_current_user(client_authorized: TestClient):
     }
 
 
+def test_current_user_claims_change(client_authorized: TestClient, session: Session):
+    assert client_authorized.get("/api/v1/users/me").status_code == 200
+
+    def changed_claims():
+        return KeycloakIDToken(
+            iss="https://lemur-15.cloud-iam.com/auth/realms/sentiment-analyzer",
+            sub="3c40da3a-483a-4736-b7e1-a85069298bd7",
+            aud=["account"],
+            exp=1727143265,
+            iat=1727107266,
+            email="olya@example.com",
+        )
+
+    app.dependency_overrides[get_oidc_keycloak_user] = changed_claims
+    response = client_authorized.get("/api/v1/users/me")
+    assert response.json()["email"] == "olya@example.com"
+    assert response.json()["organization"] is None
+
+    session.expire_all()
+    user = session.get(User, "3c40da3a-483a-4736-b7e1-a85069298bd7")
+    assert (user.email, user.organization) == ("olya@example.com", None)
+
+
 def test_uploads_empty(client_authorized: TestClient):
     response = client_authorized.get("/api/v1/uploads")
     assert response.status_code == 200
@@ -129,3 +200,436 @@ def test_create_upload(client_authorized: TestClient):
     assert len(data) == 1
     assert data[0]["id"] == upload_id
     assert data[0]["format"] == "plain"
+
+
+def test_app_import_does_not_load_model():
+    code = "import sys, app.main; sys.exit('torch' in sys.modules)"
+    assert subprocess.run([sys.executable, "-c", code]).returncode == 0
+
+
+def test_create_upload_xlsx(client_authorized: TestClient):
+    workbook = openpyxl.Workbook()
+    for text in ["I love your job", "I hate mondays", "No comment"]:
+        workbook.active.append([text])
+    file = io.BytesIO()
+    workbook.save(file)
+
+    files = {
+        "file": (
+            "test.xlsx",
+            file.getvalue(),
+            "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        )
+    }
+    response = client_authorized.post("/api/v1/uploads", files=files)
+    assert response.status_code == 200
+    data = response.json()
+    assert [entry["text"] for entry in data["entries"]] == [
+        "I love your job",
+        "I hate mondays",
+        "No comment",
+    ]
+    assert [entry["id"] for entry in data["entries"]] == [0, 1, 2]
+
+
+def test_create_upload_interview(client_authorized: TestClient):
+    document = docx.Document()
+    for paragraph in [
+        "Product interview",
+        "Респондент: Olya",
+        "Дата интервью: 01/10/2024",
+        "1. How do you like the product?",
+        "I love it",
+        "2. What would you change?",
+        "Nothing at all",
+    ]:
+        document.add_paragraph(paragraph)
+    file = io.BytesIO()
+    document.save(file)
+
+    files = {
+        "file": (
+            "interview.docx",
+            file.getvalue(),
+            "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+        )
+    }
+    response = client_authorized.post(
+        "/api/v1/uploads", files=files, params={"format": "interview-2"}
+    )
+    assert response.status_code == 200
+    data = response.json()
+    assert data["name"] == "Product interview - Olya - 01/10/2024"
+    assert data["format"] == "interview-2"
+    assert [(entry["description"], entry["text"].strip()) for entry in data["entries"]] == [
+        ("1. How do you like the product?", "I love it"),
+        ("2. What would you change?", "Nothing at all"),
+    ]
+
+
+def test_create_upload_csv(client_authorized: TestClient, kicked_uploads: list[int]):
+    files = {"file": ("test.csv", "I love your job\n\n\"Bad, really bad\"\n", "text/csv")}
+    response = client_authorized.post("/api/v1/uploads", files=files)
+    assert response.status_code == 200
+    data = response.json()
+    assert kicked_uploads == [data["id"]]
+    assert [entry["text"] for entry in data["entries"]] == [
+        "I love your job",
+        "Bad, really bad",
+    ]
+
+
+def test_create_upload_lines(client_authorized: TestClient):
+    files = {"file": ("test.txt", "first line\nsecond line\n", "text/plain")}
+    response = client_authorized.post(
+        "/api/v1/uploads", files=files, params={"format": "lines"}
+    )
+    assert response.status_code == 200
+    data = response.json()
+    assert data["format"] == "lines"
+    assert [entry["text"] for entry in data["entries"]] == ["first line", "second line"]
+    assert data["next_cursor"] is None
+
+
+def test_create_upload_returns_first_page(client_authorized: TestClient):
+    content = "".join(f"line {i}\n" for i in range(150))
+    files = {"file": ("test.txt", content, "text/plain")}
+    response = client_authorized.post(
+        "/api/v1/uploads", files=files, params={"format": "lines"}
+    )
+    assert response.status_code == 200
+    data = response.json()
+    assert len(data["entries"]) == 100
+    assert data["entries"][-1]["text"] == "line 99"
+
+    response = client_authorized.get(
+        f"/api/v1/uploads/{data['id']}", params={"after": data["next_cursor"]}
+    )
+    assert [entry["text"] for entry in response.json()["entries"]][0] == "line 100"
+
+
+def test_download_upload(client_authorized: TestClient):
+    files = {"file": ("test.csv", "I love your job\nNo comment\n", "text/csv")}
+    upload_id = client_authorized.post("/api/v1/uploads", files=files).json()["id"]
+
+    response = client_authorized.get(
+        f"/api/v1/uploads/{upload_id}/download", params={"type": "csv"}
+    )
+    assert response.status_code == 200
+    assert response.text.splitlines() == ["id,text,sentiment", "0,I love your job,", "1,No comment,"]
+
+    response = client_authorized.get(f"/api/v1/uploads/{upload_id}/download")
+    assert response.status_code == 200
+    workbook = openpyxl.load_workbook(io.BytesIO(response.content))
+    assert list(workbook.active.values) == [
+        ("id", "text", "sentiment"),
+        (0, "I love your job", None),
+        (1, "No comment", None),
+    ]
+
+
+def test_get_upload_entries_paginated(client_authorized: TestClient):
+    files = {"file": ("test.csv", "\n".join(f"text {i}" for i in range(5)), "text/csv")}
+    upload_id = client_authorized.post("/api/v1/uploads", files=files).json()["id"]
+
+    texts = []
+    cursor = None
+    while True:
+        params = {"limit": 2} if cursor is None else {"limit": 2, "after": cursor}
+        response = client_authorized.get(f"/api/v1/uploads/{upload_id}", params=params)
+        assert response.status_code == 200
+        data = response.json()
+        assert len(data["entries"]) <= 2
+        texts += [entry["text"] for entry in data["entries"]]
+        cursor = data["next_cursor"]
+        if cursor is None:
+            break
+    assert texts == [f"text {i}" for i in range(5)]
+
+    response = client_authorized.get(
+        f"/api/v1/uploads/{upload_id}", params={"include_entries": False}
+    )
+    assert response.status_code == 200
+    assert response.json()["id"] == upload_id
+    assert response.json()["entries"] == []
+
+    response = client_authorized.get(
+        f"/api/v1/uploads/{upload_id}", params={"sentiment": "positive"}
+    )
+    assert response.json()["entries"] == []
+
+
+def login(sub: str, email: str, organization: str | None = None):
+    def get_oidc_keycloak_user_override():
+        return KeycloakIDToken(
+            iss="https://lemur-15.cloud-iam.com/auth/realms/sentiment-analyzer",
+            sub=sub,
+            aud=["account"],
+            exp=1727143265,
+            iat=1727107266,
+            email=email,
+            organization={organization: dict()} if organization else None,
+        )
+
+    app.dependency_overrides[get_oidc_keycloak_user] = get_oidc_keycloak_user_override
+
+
+def test_upload_access_follows_shares(client_authorized: TestClient):
+    files = {"file": ("test.txt", "I love your job", "text/plain")}
+    upload_id = client_authorized.post("/api/v1/uploads", files=files).json()["id"]
+    path = f"/api/v1/uploads/{upload_id}"
+
+    login("colleague", "colleague@example.com", "murmurmur")
+    assert client_authorized.get(path).status_code == 403
+    login("stranger", "stranger@example.com")
+    assert client_authorized.get(path).status_code == 403
+    assert client_authorized.get("/api/v1/uploads/100").status_code == 404
+
+    login("3c40da3a-483a-4736-b7e1-a85069298bd7", "olya.shavochkina@yandex.ru", "murmurmur")
+    share = {"recipient_id": "murmurmur", "recipient_type": "org"}
+    assert client_authorized.post(f"{path}/share", json=share).status_code == 200
+
+    login("colleague", "colleague@example.com", "murmurmur")
+    assert client_authorized.get(path).status_code == 200
+    login("stranger", "stranger@example.com")
+    assert client_authorized.get(path).status_code == 403
+
+    login("3c40da3a-483a-4736-b7e1-a85069298bd7", "olya.shavochkina@yandex.ru", "murmurmur")
+    share = {"recipient_id": "stranger@example.com", "recipient_type": "user"}
+    assert client_authorized.post(f"{path}/share", json=share).status_code == 200
+    assert client_authorized.request(
+        "DELETE", f"{path}/share", json={"recipient_id": "murmurmur", "recipient_type": "org"}
+    ).status_code == 200
+
+    login("colleague", "colleague@example.com", "murmurmur")
+    assert client_authorized.get(path).status_code == 403
+    login("stranger", "stranger@example.com")
+    assert client_authorized.get(path).status_code == 200
+
+
+def test_uploads_listing_paginated(client_authorized: TestClient):
+    upload_ids = []
+    for i in range(5):
+        files = {"file": (f"test-{i}.txt", "I love your job", "text/plain")}
+        upload_ids.append(client_authorized.post("/api/v1/uploads", files=files).json()["id"])
+
+    login("colleague", "colleague@example.com", "murmurmur")
+    files = {"file": ("colleague.txt", "No comment", "text/plain")}
+    shared_id = client_authorized.post("/api/v1/uploads", files=files).json()["id"]
+    share = {"recipient_id": "murmurmur", "recipient_type": "org"}
+    client_authorized.post(f"/api/v1/uploads/{shared_id}/share", json=share)
+    client_authorized.post("/api/v1/uploads", files=files)
+
+    login("3c40da3a-483a-4736-b7e1-a85069298bd7", "olya.shavochkina@yandex.ru", "murmurmur")
+    listed = []
+    params = {"limit": 4}
+    while True:
+        response = client_authorized.get("/api/v1/uploads", params=params)
+        assert response.status_code == 200
+        listed += [upload["id"] for upload in response.json()]
+        if "X-Next-Cursor" not in response.headers:
+            break
+        params = {"limit": 4, "before": response.headers["X-Next-Cursor"]}
+
+    assert listed == [shared_id, *reversed(upload_ids)]
+
+    # the frontend runs on another origin and has to be able to read the cursor
+    response = client_authorized.get(
+        "/api/v1/uploads", params={"limit": 1}, headers={"Origin": "https://example.com"}
+    )
+    assert "X-Next-Cursor" in response.headers
+    assert "x-next-cursor" in response.headers["access-control-expose-headers"].lower()
+
+    response = client_authorized.get("/api/v1/uploads", params={"status": "ready"})
+    assert response.json() == []
+    response = client_authorized.get("/api/v1/uploads", params={"before": "garbage"})
+    assert response.status_code == 400
+
+
+def test_upload_bulk_share(client_authorized: TestClient):
+    for sub in ("alice", "bob"):
+        login(sub, f"{sub}@example.com", "partners")
+        client_authorized.get("/api/v1/uploads")
+
+    login("3c40da3a-483a-4736-b7e1-a85069298bd7", "olya.shavochkina@yandex.ru", "murmurmur")
+    files = {"file": ("test.txt", "I love your job", "text/plain")}
+    upload_id = client_authorized.post("/api/v1/uploads", files=files).json()["id"]
+    path = f"/api/v1/uploads/{upload_id}/share"
+    client_authorized.post(path, json={"recipient_id": "alice@example.com", "recipient_type": "user"})
+
+    recipients = [
+        {"recipient_id": "alice@example.com", "recipient_type": "user"},
+        {"recipient_id": "bob@example.com", "recipient_type": "user"},
+        {"recipient_id": "bob@example.com", "recipient_type": "user"},
+        {"recipient_id": "partners", "recipient_type": "org"},
+    ]
+    response = client_authorized.post(f"{path}/bulk", json={"recipients": recipients})
+    assert response.status_code == 200
+    assert response.json() == {
+        "shared": [
+            {"recipient_id": "bob", "name": "bob@example.com", "recipient_type": "user"},
+            {"recipient_id": "partners", "name": "partners", "recipient_type": "org"},
+        ],
+        "already_shared": [recipients[0]],
+    }
+    assert client_authorized.get(path).json() == [
+        {"recipient_id": "alice", "name": "alice@example.com", "recipient_type": "user"},
+        {"recipient_id": "bob", "name": "bob@example.com", "recipient_type": "user"},
+        {"recipient_id": "partners", "name": "partners", "recipient_type": "org"},
+    ]
+
+    unknown = [{"recipient_id": "nobody@example.com", "recipient_type": "user"}]
+    response = client_authorized.post(f"{path}/bulk", json={"recipients": unknown})
+    assert response.status_code == 404
+
+    login("bob", "bob@example.com", "partners")
+    response = client_authorized.request(
+        "DELETE", f"{path}/bulk", json={"recipients": recipients[3:]}
+    )
+    assert response.status_code == 403
+
+    login("3c40da3a-483a-4736-b7e1-a85069298bd7", "olya.shavochkina@yandex.ru", "murmurmur")
+    removed = [
+        {"recipient_id": "bob", "recipient_type": "user"},
+        {"recipient_id": "partners", "recipient_type": "org"},
+    ]
+    response = client_authorized.request("DELETE", f"{path}/bulk", json={"recipients": removed})
+    assert response.json() == {"removed": 2}
+
+    login("bob", "bob@example.com", "partners")
+    assert client_authorized.get(f"/api/v1/uploads/{upload_id}").status_code == 403
+
+
+def test_upload_progress_stream(client_authorized: TestClient, async_engine):
+    files = {"file": ("test.txt", "first\nsecond\n", "text/plain")}
+    upload_id = client_authorized.post(
+        "/api/v1/uploads", files=files, params={"format": "lines"}
+    ).json()["id"]
+
+    channel = MemoryProgressChannel(async_engine)
+    app.dependency_overrides[get_progress_channel] = lambda: channel
+
+    def worker():
+        while upload_id not in channel._subscribers:
+            time.sleep(0.01)
+        for status, done in [(UploadStatus.PROCESSING, 1), (UploadStatus.READY, 2)]:
+            progress = UploadProgress(
+                upload_id=upload_id, status=status, entries_done=done, entries_total=2
+            )
+            asyncio.run(channel.publish(progress))
+
+    thread = threading.Thread(target=worker)
+    thread.start()
+    response = client_authorized.get(f"/api/v1/uploads/{upload_id}/progress")
+    thread.join()
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    events = [
+        json.loads(line.removeprefix("data: "))
+        for line in response.text.splitlines()
+        if line.startswith("data: ")
+    ]
+    assert [(event["status"], event["entries_done"]) for event in events] == [
+        ("pending", 0),
+        ("processing", 1),
+        ("ready", 2),
+    ]
+
+
+def test_upload_summaries(client_authorized: TestClient, session: Session):
+    files = {"file": ("test.txt", "I love your job", "text/plain")}
+    upload_id = client_authorized.post("/api/v1/uploads", files=files).json()["id"]
+    files = {"file": ("other.txt", "No comment", "text/plain")}
+    other_id = client_authorized.post("/api/v1/uploads", files=files).json()["id"]
+    login("stranger", "stranger@example.com")
+    files = {"file": ("stranger.txt", "I hate mondays", "text/plain")}
+    stranger_id = client_authorized.post("/api/v1/uploads", files=files).json()["id"]
+
+    for id, question, sentiment, count in [
+        (upload_id, "1. Why?", SentimentPredictLevel.POSITIVE, 3),
+        (upload_id, "2. How?", SentimentPredictLevel.NEGATIVE, 1),
+        (other_id, "", SentimentPredictLevel.POSITIVE, 2),
+        (stranger_id, "", SentimentPredictLevel.NEGATIVE, 5),
+    ]:
+        session.add(UploadSummary(upload_id=id, question=question, sentiment=sentiment, count=count))
+    session.commit()
+
+    login("3c40da3a-483a-4736-b7e1-a85069298bd7", "olya.shavochkina@yandex.ru", "murmurmur")
+    response = client_authorized.get(f"/api/v1/uploads/{upload_id}/summary")
+    assert response.status_code == 200
+    data = response.json()
+    assert (data["total"], data["sentiments"]["positive"], data["sentiments"]["negative"]) == (4, 3, 1)
+    assert [(q["question"], q["total"]) for q in data["questions"]] == [("1. Why?", 3), ("2. How?", 1)]
+
+    response = client_authorized.get("/api/v1/uploads/summary")
+    assert response.status_code == 200
+    data = response.json()
+    assert (data["uploads"], data["total"], data["sentiments"]["positive"]) == (2, 6, 5)
+
+
+def test_metrics(client_authorized: TestClient):
+    route = {"method": "GET", "route": "/api/v1/uploads/{upload_id}"}
+
+    def sample(name: str, labels: dict) -> float:
+        return REGISTRY.get_sample_value(name, labels) or 0
+
+    requests = sample("http_request_duration_seconds_count", {**route, "status": "200"})
+    queries = sample("http_request_db_queries_sum", route)
+
+    files = {"file": ("test.txt", "I love your job", "text/plain")}
+    upload_id = client_authorized.post("/api/v1/uploads", files=files).json()["id"]
+    client_authorized.get(f"/api/v1/uploads/{upload_id}")
+
+    response = client_authorized.get("/metrics")
+    assert response.status_code == 200
+    assert "http_request_duration_seconds_bucket" in response.text
+    assert sample("http_request_duration_seconds_count", {**route, "status": "200"}) == requests + 1
+    assert sample("http_request_db_queries_sum", route) > queries
+    assert sample(
+        "http_request_db_queries_sum", {"method": "POST", "route": "/api/v1/uploads"}
+    ) > 0
+
+
+def test_server_timing(client_authorized: TestClient):
+    files = {"file": ("test.txt", "I love your job", "text/plain")}
+    response = client_authorized.post("/api/v1/uploads", files=files)
+    assert response.status_code == 200
+
+    phases = {
+        entry.split(";")[0]: entry for entry in response.headers["server-timing"].split(", ")
+    }
+    assert {"db", "parse", "serialize", "total"} <= phases.keys()
+    assert "queries" in phases["db"]
+
+
+def test_profile_on_header(client_authorized: TestClient, monkeypatch, tmp_path):
+    monkeypatch.setattr(settings, "profile_header", "X-Profile")
+    monkeypatch.setattr(settings, "profile_secret", "secret")
+    monkeypatch.setattr(settings, "profile_dir", str(tmp_path / "profiles"))
+
+    files = {"file": ("test.txt", "I love your job", "text/plain")}
+    upload_id = client_authorized.post("/api/v1/uploads", files=files).json()["id"]
+    client_authorized.get(f"/api/v1/uploads/{upload_id}", headers={"X-Profile": "1"})
+    assert not (tmp_path / "profiles").exists()
+
+    response = client_authorized.get(
+        f"/api/v1/uploads/{upload_id}", headers={"X-Profile": "secret"}
+    )
+    assert response.status_code == 200
+
+    profiles = list((tmp_path / "profiles").iterdir())
+    assert len(profiles) == 1
+    assert profiles[0].name.endswith(f"-GET-api-v1-uploads-{upload_id}.html")
+
+
+def test_profiles_pruned(client_authorized: TestClient, monkeypatch, tmp_path):
+    monkeypatch.setattr(settings, "profile_header", "X-Profile")
+    monkeypatch.setattr(settings, "profile_secret", "secret")
+    monkeypatch.setattr(settings, "profile_dir", str(tmp_path / "profiles"))
+    monkeypatch.setattr(settings, "profile_max_files", 2)
+
+    for _ in range(3):
+        client_authorized.get("/api/v1/uploads", headers={"X-Profile": "secret"})
+
+    assert len(list((tmp_path / "profiles").iterdir())) == 2
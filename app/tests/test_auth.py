@@ -0,0 +1,99 @@
+import time
+
+import jwt
+import pytest
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+from app.services.auth import JWKSCache, TokenVerifier
+
+
+class LocalJWKS:
+    """Stand-in for the Keycloak certs endpoint."""
+
+    def __init__(self):
+        self.keys: dict[str, rsa.RSAPrivateKey] = {}
+        self.fetches = 0
+        self.available = True
+
+    def add_key(self, kid: str):
+        self.keys[kid] = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+
+    def fetch(self) -> dict:
+        self.fetches += 1
+        if not self.available:
+            raise jwt.exceptions.PyJWKClientConnectionError("IdP is down")
+        return {
+            "keys": [
+                {
+                    **jwt.algorithms.RSAAlgorithm.to_jwk(key.public_key(), as_dict=True),
+                    "kid": kid,
+                    "use": "sig",
+                    "alg": "RS256",
+                }
+                for kid, key in self.keys.items()
+            ]
+        }
+
+    def token(self, kid: str, exp_in: int = 300) -> str:
+        now = int(time.time())
+        claims = {
+            "iss": "https://idp.example.com",
+            "sub": "3c40da3a-483a-4736-b7e1-a85069298bd7",
+            "aud": "account",
+            "iat": now,
+            "exp": now + exp_in,
+            "email": "olya.shavochkina@yandex.ru",
+        }
+        return jwt.encode(claims, self.keys[kid], algorithm="RS256", headers={"kid": kid})
+
+
+@pytest.fixture(name="jwks")
+def jwks_fixture():
+    jwks = LocalJWKS()
+    jwks.add_key("key-1")
+    return jwks
+
+
+def test_keys_and_tokens_are_cached(jwks: LocalJWKS):
+    verifier = TokenVerifier(JWKSCache(jwks.fetch, ttl=300), cache_size=10)
+    token = jwks.token("key-1")
+
+    first = verifier.verify(token)
+    second = verifier.verify(token)
+    verifier.verify(jwks.token("key-1", exp_in=600))
+
+    assert first.email == "olya.shavochkina@yandex.ru"
+    assert second is first
+    assert jwks.fetches == 1
+
+
+def test_unknown_kid_refreshes_keys(jwks: LocalJWKS):
+    verifier = TokenVerifier(JWKSCache(jwks.fetch, ttl=300, min_refresh_interval=0))
+    verifier.verify(jwks.token("key-1"))
+
+    jwks.add_key("key-2")
+    assert verifier.verify(jwks.token("key-2")).sub
+    assert jwks.fetches == 2
+
+    foreign = LocalJWKS()
+    foreign.add_key("key-3")
+    with pytest.raises(jwt.exceptions.InvalidTokenError):
+        verifier.verify(foreign.token("key-3"))
+    assert jwks.fetches == 3
+
+
+def test_expired_token_rejected(jwks: LocalJWKS):
+    verifier = TokenVerifier(JWKSCache(jwks.fetch, ttl=300))
+
+    with pytest.raises(jwt.exceptions.ExpiredSignatureError):
+        verifier.verify(jwks.token("key-1", exp_in=-10))
+
+
+def test_stale_keys_used_when_idp_is_down(jwks: LocalJWKS):
+    verifier = TokenVerifier(JWKSCache(jwks.fetch, ttl=0), cache_size=0)
+    verifier.verify(jwks.token("key-1"))
+
+    jwks.available = False
+    assert verifier.verify(jwks.token("key-1")).sub
+    assert jwks.fetches == 2
+
@@ -0,0 +1,36 @@
+import asyncio
+
+from app.services.batch_scheduler import BatchScheduler
+from app.models.sentiment import SentimentPredictLevel
+
+
+def test_concurrent_requests_share_one_batch(predictor):
+    scheduler = BatchScheduler(predictor, max_batch_size=64, max_wait_ms=50)
+
+    async def run():
+        results = await asyncio.gather(
+            *(scheduler.predict([f"good {i}", f"bad {i}"]) for i in range(10))
+        )
+        await scheduler.shutdown()
+        return results
+
+    results = asyncio.run(run())
+
+    assert len(predictor.calls) == 1
+    assert len(predictor.calls[0]) == 20
+    assert all(
+        result == [SentimentPredictLevel.POSITIVE, SentimentPredictLevel.NEGATIVE]
+        for result in results
+    )
+
+
+def test_flush_at_max_batch_size(predictor):
+    scheduler = BatchScheduler(predictor, max_batch_size=4, max_wait_ms=1000)
+
+    async def run():
+        result = await scheduler.predict([f"good {i}" for i in range(8)])
+        await scheduler.shutdown()
+        return result
+
+    assert asyncio.run(run()) == [SentimentPredictLevel.POSITIVE] * 8
+    assert [len(call) for call in predictor.calls] == [4, 4]
@@ -0,0 +1,36 @@
+import io
+
+import openpyxl
+
+from app.models.upload import UploadFormat
+from app.routes.uploads import parse_docx
+from app.tools.benchmark import compare
+from app.tools.synthetic import docx_file, interview_docx_file, synthetic_texts, xlsx_file
+
+
+def test_synthetic_texts_are_reproducible():
+    texts = synthetic_texts(5, words=10, seed=1)
+    assert texts == synthetic_texts(5, words=10, seed=1)
+    assert texts != synthetic_texts(5, words=10, seed=2)
+    assert all(len(text.split()) == 10 for text in texts)
+
+
+def test_synthetic_files_parse_like_uploads():
+    texts = synthetic_texts(3)
+
+    workbook = openpyxl.load_workbook(io.BytesIO(xlsx_file(texts)))
+    assert [row[0] for row in workbook.active.iter_rows(values_only=True)] == texts
+
+    name, rows = parse_docx(io.BytesIO(interview_docx_file(texts)), UploadFormat.INTERVIEW_2)
+    assert name == "Synthetic interview - Benchmark - 01/10/2024"
+    assert [row["text"].strip() for row in rows] == texts
+
+    name, rows = parse_docx(io.BytesIO(docx_file(texts)), UploadFormat.PLAIN)
+    assert name is None
+    assert rows == [{"id": 1, "text": "\n".join(texts)}]
+
+
+def test_compare_reports_slower_cases():
+    baseline = {"results": {"a": {"seconds": 1.0}, "b": {"seconds": 1.0}}}
+    results = {"a": {"seconds": 1.1}, "b": {"seconds": 1.5}, "new": {"seconds": 9.0}}
+    assert compare(results, baseline, tolerance=0.2) == ["b: 1.0000s -> 1.5000s"]
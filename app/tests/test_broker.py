@@ -0,0 +1,390 @@
+import asyncio
+
+import pytest
+from prometheus_client import REGISTRY
+from sqlmodel import Session, func, select
+from taskiq import TaskiqMessage, TaskiqMiddleware
+
+import app.broker
+from app.broker import broker, finish_shard, kick_upload, process_upload
+from app.models.prediction_cache import PredictionCacheEntry
+from app.models.sentiment import SentimentPredictLevel
+from app.models.upload import (
+    Upload,
+    UploadEntry,
+    UploadEntryChunk,
+    UploadStatus,
+    UploadSummary,
+)
+from app.models.user import User
+from app.services.progress import MemoryProgressChannel
+from app.services.scheduling import task_priority
+
+
+@pytest.fixture(name="engine")
+def engine_fixture(engine, async_engine, monkeypatch):
+    monkeypatch.setattr(app.broker, "async_engine", async_engine)
+    return engine
+
+
+@pytest.fixture(name="predictor")
+def predictor_fixture(predictor, monkeypatch):
+    monkeypatch.setattr(app.broker, "predictor", predictor)
+    return predictor
+
+
+def run_task(task, **kwargs):
+    async def run():
+        await task.kiq(**kwargs)
+        # wait for the task and every subtask it kicked
+        while broker._running_tasks:
+            await asyncio.gather(*broker._running_tasks, return_exceptions=True)
+
+    asyncio.run(run())
+
+
+def create_upload(engine, texts: list[str]) -> int:
+    with Session(engine) as session:
+        session.add(User(id="owner", email="owner@example.com"))
+        upload = Upload(name="test.xlsx", created_by_user_id="owner")
+        session.add(upload)
+        session.commit()
+        session.refresh(upload)
+
+        for i, text in enumerate(texts):
+            session.add(UploadEntry(upload_id=upload.id, id=i, text=text))
+        session.commit()
+        return upload.id
+
+
+def test_small_upload_processed_inline(engine, predictor):
+    upload_id = create_upload(engine, ["good", "bad"])
+    task = {"task": process_upload.task_name}
+    waits = REGISTRY.get_sample_value("task_queue_wait_seconds_count", task) or 0
+    processed = REGISTRY.get_sample_value("upload_entries_processed_total")
+
+    run_task(process_upload, upload_id=upload_id)
+
+    assert REGISTRY.get_sample_value("task_queue_wait_seconds_count", task) == waits + 1
+    assert REGISTRY.get_sample_value("upload_entries_processed_total") == processed + 2
+
+    with Session(engine) as session:
+        assert session.get(Upload, upload_id).status == UploadStatus.READY
+        assert session.get(Upload, upload_id).shards_total == 0
+    assert predictor.calls == [["good", "bad"]]
+
+
+def test_large_upload_fanned_out_to_shards(engine, predictor, monkeypatch):
+    monkeypatch.setattr(app.broker.settings, "upload_shard_size", 3)
+    upload_id = create_upload(engine, [f"text {i}" for i in range(10)])
+
+    run_task(process_upload, upload_id=upload_id)
+
+    with Session(engine) as session:
+        upload = session.get(Upload, upload_id)
+        assert upload.status == UploadStatus.READY
+        assert (upload.shards_total, upload.shards_done, upload.shards_failed) == (4, 4, 0)
+        entries = session.exec(select(UploadEntry).where(UploadEntry.upload_id == upload_id))
+        assert all(entry.sentiment == SentimentPredictLevel.POSITIVE for entry in entries)
+    # shards are scored concurrently
+    assert sorted(len(call) for call in predictor.calls) == [1, 3, 3, 3]
+
+
+def test_redelivered_upload_keeps_kicked_shards(engine, predictor, monkeypatch):
+    monkeypatch.setattr(app.broker.settings, "upload_shard_size", 3)
+    upload_id = create_upload(engine, [f"text {i}" for i in range(10)])
+    kick_owner_shards = app.broker.kick_owner_shards
+    calls = 0
+
+    async def fail_after_first_kicks(owner_id: str):
+        nonlocal calls
+        calls += 1
+        await kick_owner_shards(owner_id)
+        if calls == 1:
+            raise RuntimeError("connection lost after publishing")
+
+    monkeypatch.setattr(app.broker, "kick_owner_shards", fail_after_first_kicks)
+
+    run_task(process_upload, upload_id=upload_id)
+
+    with Session(engine) as session:
+        upload = session.get(Upload, upload_id)
+        assert upload.status == UploadStatus.READY
+        assert (upload.shards_total, upload.shards_kicked, upload.shards_done) == (4, 4, 4)
+        assert (upload.entries_total, upload.entries_done) == (10, 10)
+        counts = session.exec(
+            select(UploadSummary.count).where(UploadSummary.upload_id == upload_id)
+        ).all()
+        assert sum(counts) == 10
+    assert sorted(len(call) for call in predictor.calls) == [1, 3, 3, 3]
+
+
+def test_owner_shards_capped(engine, predictor, monkeypatch):
+    monkeypatch.setattr(app.broker.settings, "upload_shard_size", 3)
+    monkeypatch.setattr(app.broker.settings, "owner_max_shards", 1)
+    upload_id = create_upload(engine, [f"text {i}" for i in range(10)])
+
+    run_task(process_upload, upload_id=upload_id)
+
+    with Session(engine) as session:
+        upload = session.get(Upload, upload_id)
+        assert upload.status == UploadStatus.READY
+        assert (upload.shards_total, upload.shards_kicked, upload.shards_done) == (4, 4, 4)
+    # every shard was only kicked once the previous one finished
+    assert [call[0] for call in predictor.calls] == ["text 0", "text 3", "text 6", "text 9"]
+
+
+def test_deleted_upload_frees_owner_shard(engine, predictor, monkeypatch):
+    monkeypatch.setattr(app.broker.settings, "upload_shard_size", 2)
+    monkeypatch.setattr(app.broker.settings, "owner_max_shards", 1)
+    upload_id = create_upload(engine, ["a", "b", "c", "d"])
+    with Session(engine) as session:
+        # queued behind a shard of an upload that was deleted while it ran
+        upload = session.get(Upload, upload_id)
+        upload.status = UploadStatus.PROCESSING
+        upload.shards_total = 2
+        session.add(upload)
+        session.commit()
+
+    async def run():
+        await finish_shard(upload_id + 1, failed=False, owner_id="owner")
+        while broker._running_tasks:
+            await asyncio.gather(*broker._running_tasks)
+
+    asyncio.run(run())
+
+    with Session(engine) as session:
+        upload = session.get(Upload, upload_id)
+        assert upload.status == UploadStatus.READY
+        assert (upload.shards_kicked, upload.shards_done) == (2, 2)
+
+
+def test_tasks_kicked_with_size_priority(engine, predictor, monkeypatch):
+    monkeypatch.setattr(app.broker.settings, "upload_shard_size", 2)
+    monkeypatch.setattr(app.broker.settings, "priority_lanes", [2, 3])
+    sent = []
+
+    class RecordLabels(TaskiqMiddleware):
+        def pre_send(self, message: TaskiqMessage) -> TaskiqMessage:
+            sent.append((message.task_name, int(message.labels["priority"])))
+            return message
+
+    monkeypatch.setattr(broker, "middlewares", [*broker.middlewares, RecordLabels()])
+    small = create_upload(engine, ["a", "b"])
+    with Session(engine) as session:
+        large = Upload(name="large.xlsx", created_by_user_id="owner")
+        session.add(large)
+        session.commit()
+        session.add_all(UploadEntry(upload_id=large.id, id=i, text="c") for i in range(4))
+        session.commit()
+        large_id = large.id
+
+    async def run():
+        await kick_upload(small, 2)
+        await kick_upload(large_id, 4)
+        while broker._running_tasks:
+            await asyncio.gather(*broker._running_tasks)
+
+    asyncio.run(run())
+
+    assert (task_priority(2), task_priority(3), task_priority(4)) == (2, 1, 0)
+    assert sorted(sent) == sorted(
+        [
+            (process_upload.task_name, 2),
+            (process_upload.task_name, 0),
+            (app.broker.process_upload_shard.task_name, 0),
+            (app.broker.process_upload_shard.task_name, 0),
+        ]
+    )
+
+
+def test_failed_shard_marks_upload_error(engine, predictor, monkeypatch):
+    monkeypatch.setattr(app.broker.settings, "upload_shard_size", 2)
+    upload_id = create_upload(engine, ["a", "b", "c", "d"])
+
+    predict_batch = predictor.predict_batch
+
+    def fail_second_shard(values):
+        if values == ["c", "d"]:
+            raise RuntimeError("model crashed")
+        return predict_batch(values)
+
+    monkeypatch.setattr(predictor, "predict_batch", fail_second_shard)
+
+    run_task(process_upload, upload_id=upload_id)
+
+    with Session(engine) as session:
+        upload = session.get(Upload, upload_id)
+        assert upload.status == UploadStatus.ERROR
+        assert (upload.shards_done, upload.shards_failed) == (1, 1)
+        assert (upload.entries_total, upload.entries_done) == (4, 2)
+
+
+def test_processing_resumes_from_checkpoint(engine, predictor, monkeypatch):
+    monkeypatch.setattr(app.broker.settings, "process_batch_size", 2)
+    upload_id = create_upload(engine, ["a", "b", "c", "d", "e"])
+    with Session(engine) as session:
+        # a previous run scored the first batch before the worker died
+        for entry in session.exec(select(UploadEntry).where(UploadEntry.id < 2)):
+            entry.sentiment = SentimentPredictLevel.NEGATIVE
+            session.add(entry)
+        session.commit()
+
+    predict_batch = predictor.predict_batch
+    calls = 0
+
+    def fail_once(values):
+        nonlocal calls
+        calls += 1
+        if calls == 2:
+            raise RuntimeError("worker lost")
+        return predict_batch(values)
+
+    monkeypatch.setattr(predictor, "predict_batch", fail_once)
+
+    run_task(process_upload, upload_id=upload_id)
+
+    with Session(engine) as session:
+        upload = session.get(Upload, upload_id)
+        assert upload.status == UploadStatus.READY
+        assert (upload.entries_total, upload.entries_done) == (5, 5)
+        sentiments = session.exec(
+            select(UploadEntry.sentiment).where(UploadEntry.upload_id == upload_id)
+        ).all()
+        assert sentiments == [SentimentPredictLevel.NEGATIVE] * 2 + [
+            SentimentPredictLevel.POSITIVE
+        ] * 3
+    # the retry picked up after the committed ["c", "d"] batch
+    assert calls == 3
+
+
+def test_progress_published_per_batch(engine, predictor, monkeypatch):
+    monkeypatch.setattr(app.broker.settings, "process_batch_size", 2)
+    channel = MemoryProgressChannel(app.broker.async_engine)
+    monkeypatch.setattr(app.broker, "progress_channel", channel)
+    upload_id = create_upload(engine, ["a", "b", "c"])
+
+    async def run():
+        events = []
+        async with channel.subscribe(upload_id) as subscription:
+            await process_upload.kiq(upload_id=upload_id)
+            while not events or not events[-1].finished:
+                events.append(await asyncio.wait_for(subscription.next(), 5))
+        await asyncio.gather(*broker._running_tasks)
+        return events
+
+    events = asyncio.run(run())
+
+    assert [(event.status, event.entries_done, event.entries_total) for event in events] == [
+        (UploadStatus.PROCESSING, 0, 3),
+        (UploadStatus.PROCESSING, 2, 3),
+        (UploadStatus.PROCESSING, 3, 3),
+        (UploadStatus.READY, 3, 3),
+    ]
+
+
+def test_summary_counted_per_question(engine, predictor, monkeypatch):
+    monkeypatch.setattr(app.broker.settings, "process_batch_size", 2)
+    with Session(engine) as session:
+        session.add(User(id="owner", email="owner@example.com"))
+        upload = Upload(name="interview", created_by_user_id="owner")
+        session.add(upload)
+        session.commit()
+        session.refresh(upload)
+        upload_id = upload.id
+
+        for i, (question, text) in enumerate(
+            [("1. Why?", "good"), ("2. How?", "fail"), ("1. Why?", "fine"), ("2. How?", "fail")]
+        ):
+            session.add(UploadEntry(upload_id=upload_id, id=i, text=text, description=question))
+        session.commit()
+
+    run_task(process_upload, upload_id=upload_id)
+
+    with Session(engine) as session:
+        rows = session.exec(
+            select(UploadSummary.question, UploadSummary.sentiment, UploadSummary.count)
+            .where(UploadSummary.upload_id == upload_id)
+            .order_by(UploadSummary.question)
+        ).all()
+    # both batches add to the same counts
+    assert rows == [
+        ("1. Why?", SentimentPredictLevel.POSITIVE, 2),
+        ("2. How?", SentimentPredictLevel.NEGATIVE, 2),
+    ]
+
+
+def test_long_document_chunks_point_into_original_text(engine, predictor, monkeypatch):
+    monkeypatch.setattr(app.broker.settings, "long_document_mode", True)
+    text = " ".join(f"ответ{i} answer{i}" for i in range(100))
+    upload_id = create_upload(engine, [text])
+
+    run_task(process_upload, upload_id=upload_id)
+
+    ascii_text = "".join(char for char in text if ord(char) < 128)
+    middle = len(ascii_text) // 2
+    with Session(engine) as session:
+        chunks = session.exec(
+            select(UploadEntryChunk)
+            .where(UploadEntryChunk.upload_id == upload_id)
+            .order_by(UploadEntryChunk.id)
+        ).all()
+    assert len(chunks) == 2
+    for chunk, expected in zip(chunks, [ascii_text[:middle], ascii_text[middle:]]):
+        original = text[chunk.start : chunk.end]
+        assert "".join(char for char in original if ord(char) < 128) == expected
+        assert original[0] == expected[0] and original[-1] == expected[-1]
+
+
+def test_pipeline_with_long_documents(engine, monkeypatch):
+    # the real model: the tokenize stage and the long documents in the
+    # forward stage use the same tokenizer from two threads
+    from app.services.prediction_cache import (
+        CachedSentimentPredict,
+        PredictionCache,
+        normalize_text,
+    )
+    from app.services.sentiment_predict import SentimentPredict
+
+    predictor = CachedSentimentPredict(SentimentPredict(), PredictionCache(engine))
+    monkeypatch.setattr(app.broker, "predictor", predictor)
+    monkeypatch.setattr(app.broker.settings, "long_document_mode", True)
+    monkeypatch.setattr(app.broker.settings, "process_batch_size", 4)
+    long_text = " ".join(f"the delivery number {i} was late again" for i in range(120))
+    texts = [text for i in range(12) for text in (f"short answer {i}", f"{i} {long_text}")]
+    upload_id = create_upload(engine, texts)
+
+    run_task(process_upload, upload_id=upload_id)
+
+    with Session(engine) as session:
+        upload = session.get(Upload, upload_id)
+        assert upload.status == UploadStatus.READY
+        assert upload.entries_done == len(texts)
+        # short entries' predictions were cached with the entries; long
+        # documents aren't cached
+        cached = session.exec(select(func.count()).select_from(PredictionCacheEntry)).one()
+        assert cached == len({normalize_text(text) for text in texts[::2]})
+        chunked = session.exec(
+            select(UploadEntryChunk.entry_id).where(UploadEntryChunk.upload_id == upload_id)
+        ).all()
+    assert set(chunked) == {i for i in range(len(texts)) if i % 2}
+
+
+def test_overlapping_runs_count_entries_once(engine, predictor):
+    upload_id = create_upload(engine, ["a", "b", "c", "d"])
+
+    async def run():
+        await asyncio.gather(
+            app.broker.score_entry_range(upload_id, 0, 4),
+            app.broker.score_entry_range(upload_id, 0, 4),
+        )
+
+    asyncio.run(run())
+
+    with Session(engine) as session:
+        assert session.get(Upload, upload_id).entries_done == 4
+        counts = session.exec(
+            select(UploadSummary.count).where(UploadSummary.upload_id == upload_id)
+        ).all()
+        assert sum(counts) == 4
+
@@ -0,0 +1,61 @@
+import asyncio
+
+import pytest
+
+from app.services.pipeline import run_pipeline
+
+
+async def numbers(count: int):
+    for i in range(count):
+        yield i
+
+
+def test_pipeline_keeps_order():
+    written = []
+
+    async def slow_double(value: int) -> int:
+        await asyncio.sleep(0.001 * (5 - value))
+        return value * 2
+
+    async def write(value: int):
+        written.append(value)
+
+    asyncio.run(run_pipeline(numbers(5), [slow_double, write], maxsize=2))
+
+    assert written == [0, 2, 4, 6, 8]
+
+
+def test_pipeline_failure_drains_later_stages():
+    fed = []
+    written = []
+
+    async def source():
+        for i in range(100):
+            fed.append(i)
+            yield i
+
+    async def fail_on_three(value: int) -> int:
+        if value == 3:
+            raise RuntimeError("model crashed")
+        return value
+
+    async def write(value: int):
+        await asyncio.sleep(0.001)
+        written.append(value)
+
+    with pytest.raises(RuntimeError, match="model crashed"):
+        asyncio.run(run_pipeline(source(), [fail_on_three, write], maxsize=1))
+
+    # everything before the failed item was written, and the bounded queues
+    # kept the source from running far ahead
+    assert written == [0, 1, 2]
+    assert len(fed) < 10
+
+
+def test_pipeline_needs_bounded_queues():
+    async def write(value: int):
+        pass
+
+    with pytest.raises(ValueError):
+        asyncio.run(run_pipeline(numbers(1), [write], maxsize=0))
+
@@ -0,0 +1,39 @@
+from app.services.prediction_cache import CachedSentimentPredict, PredictionCache
+from app.models.sentiment import SentimentPredictLevel
+
+
+def test_duplicates_scored_once(engine, predictor):
+    cache = PredictionCache(engine, maxsize=10)
+    cached = CachedSentimentPredict(predictor, cache)
+
+    result = cached.predict_batch(["No comment", "no   comment", "Something else"])
+
+    assert result == [SentimentPredictLevel.POSITIVE] * 3
+    assert predictor.calls == [["no comment", "something else"]]
+    assert cache.stats().duplicates == 1
+    assert cache.stats().misses == 2
+
+
+def test_db_tier_shared_between_instances(engine, predictor):
+    first = CachedSentimentPredict(predictor, PredictionCache(engine, maxsize=10))
+    first.predict_batch(["no comment"])
+
+    cache = PredictionCache(engine, maxsize=10)
+    second = CachedSentimentPredict(predictor, cache)
+
+    assert second.predict_batch(["No comment"]) == [SentimentPredictLevel.POSITIVE]
+    assert predictor.calls == [["no comment"]]
+    assert cache.stats().db_hits == 1
+
+    second.predict_batch(["No comment"])
+    assert cache.stats().memory_hits == 1
+
+
+def test_memory_tier_evicts_least_recently_used(engine, predictor):
+    cache = PredictionCache(engine, maxsize=2, use_db=False)
+    cached = CachedSentimentPredict(predictor, cache)
+
+    cached.predict_batch(["a", "b", "c"])
+    cached.predict_batch(["c", "a"])
+
+    assert predictor.calls == [["a", "b", "c"], ["a"]]
@@ -1,21 +1,43 @@
 import pytest
 
 from app.services.sentiment_predict import SentimentPredict, SentimentPredictLevel
+from app.tools.labelled_cases import labelled_cases
 
-test_data = [
-    ("I am very clever", SentimentPredictLevel.VERY_POSITIVE),
-    ("I am dumb", SentimentPredictLevel.VERY_NEGATIVE),
-    ("You job offerring does not look great", SentimentPredictLevel.NEGATIVE),
-    (
-        "My work helped my company to increase revenue by 50%",
-        SentimentPredictLevel.POSITIVE,
-    ),
-    ("I like cats", SentimentPredictLevel.NEUTRAL),
-    ("", SentimentPredictLevel.NEUTRAL),
-]
 
-
-@pytest.mark.parametrize("text, expected", test_data)
+@pytest.mark.parametrize("text, expected", labelled_cases)
 def test_sentiment_predict(text: str, expected: SentimentPredictLevel):
     sentiment_predict = SentimentPredict()
     assert sentiment_predict.predict(text) == expected
+
+
+def test_sentiment_predict_batch_keeps_order():
+    sentiment_predict = SentimentPredict()
+    texts = [text for text, _ in labelled_cases]
+    assert sentiment_predict.predict_batch(texts, batch_size=4) == [
+        sentiment_predict.predict(text) for text in texts
+    ]
+
+
+def test_onnx_backend_matches_torch(tmp_path, monkeypatch):
+    pytest.importorskip("onnxruntime")
+    from app.settings import settings
+
+    monkeypatch.setattr(settings, "onnx_model_path", str(tmp_path / "model.onnx"))
+    texts = [text for text, _ in labelled_cases]
+    assert SentimentPredict("onnx").predict_batch(texts) == SentimentPredict(
+        "torch"
+    ).predict_batch(texts)
+
+
+def test_predict_documents_scores_every_window():
+    sentiment_predict = SentimentPredict()
+    text = " ".join(["My work helped my company to increase revenue by 50%"] * 200)
+
+    short, long = sentiment_predict.predict_documents(["I like cats", text], stride=32)
+
+    assert len(short.chunks) == 1
+    assert short.sentiment == sentiment_predict.predict("I like cats")
+    assert len(long.chunks) > 1
+    assert long.chunks[0].start == 0
+    assert long.chunks[-1].end == len(text)
+    assert all(a.start < b.start < a.end for a, b in zip(long.chunks, long.chunks[1:]))
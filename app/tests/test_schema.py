@@ -0,0 +1,41 @@
+from sqlalchemy import create_engine, inspect
+from sqlmodel import Session, select
+from sqlmodel.pool import StaticPool
+
+from app.models.upload import Upload, UploadStatus
+from app.services.schema import upgrade_schema
+
+
+def test_upgrade_adds_missing_columns_and_indexes():
+    engine = create_engine(
+        "sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool
+    )
+    # the upload table as created before the progress counters
+    with engine.begin() as connection:
+        connection.exec_driver_sql('CREATE TABLE "user" (id VARCHAR NOT NULL PRIMARY KEY)')
+        connection.exec_driver_sql(
+            "CREATE TABLE upload (name VARCHAR NOT NULL, id INTEGER NOT NULL PRIMARY KEY, "
+            "created_at DATETIME NOT NULL, created_by_user_id VARCHAR NOT NULL, "
+            "status VARCHAR(10) NOT NULL, format VARCHAR(11) NOT NULL)"
+        )
+        connection.exec_driver_sql("INSERT INTO \"user\" (id) VALUES ('user')")
+        connection.exec_driver_sql(
+            "INSERT INTO upload VALUES ('old', 1, '2024-01-01 00:00:00', 'user', 'READY', 'PLAIN')"
+        )
+
+    upgrade_schema(engine)
+    # running it again finds nothing to do
+    upgrade_schema(engine)
+
+    inspector = inspect(engine)
+    columns = {column["name"] for column in inspector.get_columns("upload")}
+    assert {"shards_total", "shards_done", "entries_total", "entries_done"} <= columns
+    indexes = {index["name"] for index in inspector.get_indexes("upload")}
+    assert "ix_upload_created_at_id" in indexes
+    assert "uploadsummary" in inspector.get_table_names()
+
+    with Session(engine) as session:
+        upload = session.exec(select(Upload)).one()
+    assert upload.status == UploadStatus.READY
+    assert upload.shards_total == 0
+    assert upload.entries_done == 0
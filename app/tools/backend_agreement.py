@@ -0,0 +1,97 @@
+"""
+Compares inference backends against the torch baseline.
+
+Usage:
+
+    python -m app.tools.backend_agreement --corpus texts.txt --min-agreement 0.98
+
+The labelled cases from `app/tools/labelled_cases.py` are always checked.
+A corpus is a text file with one sample per line. The report is printed as
+JSON; the exit code is 1 if any backend agrees with torch on fewer than
+`--min-agreement` of the texts.
+"""
+
+import argparse
+import json
+import sys
+import time
+
+from app.services.inference_backends import TorchBackend, backends
+from app.services.sentiment_predict import SentimentPredict
+from app.tools.labelled_cases import labelled_cases
+
+
+def run_backend(backend: str, texts: list[str], batch_size: int) -> tuple[list, float]:
+    predictor = SentimentPredict(backend)
+    predictor.warm_up()
+
+    start = time.perf_counter()
+    predictions = predictor.predict_batch(texts, batch_size=batch_size)
+    return predictions, time.perf_counter() - start
+
+
+def compare(
+    candidates: list[str], corpus: list[str], batch_size: int
+) -> dict[str, dict]:
+    labelled_texts = [text for text, _ in labelled_cases]
+    expected = [label for _, label in labelled_cases]
+    texts = labelled_texts + corpus
+
+    baseline, baseline_seconds = run_backend(TorchBackend.name, texts, batch_size)
+    report = {}
+    for backend in [TorchBackend.name, *candidates]:
+        if backend == TorchBackend.name:
+            predictions, seconds = baseline, baseline_seconds
+        else:
+            predictions, seconds = run_backend(backend, texts, batch_size)
+
+        labelled = predictions[: len(labelled_texts)]
+        report[backend] = {
+            "agreement_with_torch": sum(
+                a == b for a, b in zip(predictions, baseline)
+            ) / len(texts),
+            "labelled_accuracy": sum(
+                a == b for a, b in zip(labelled, expected)
+            ) / len(expected),
+            "labelled_mismatches": [
+                {"text": text, "expected": want, "predicted": got}
+                for text, want, got in zip(labelled_texts, expected, labelled)
+                if want != got
+            ],
+            "seconds": seconds,
+            "texts_per_second": len(texts) / seconds if seconds else None,
+        }
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--backends",
+        nargs="+",
+        default=[name for name in backends if name != TorchBackend.name],
+        choices=[name for name in backends if name != TorchBackend.name],
+    )
+    parser.add_argument("--corpus", help="text file with one sample per line")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--min-agreement", type=float, default=0.98)
+    args = parser.parse_args()
+
+    corpus = []
+    if args.corpus:
+        with open(args.corpus, encoding="utf-8") as f:
+            corpus = [line.strip() for line in f if line.strip()]
+
+    report = compare(args.backends, corpus, args.batch_size)
+    json.dump(report, sys.stdout, indent=2)
+    print()
+
+    if any(
+        result["agreement_with_torch"] < args.min_agreement
+        for result in report.values()
+    ):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,310 @@
+"""
+Benchmarks the predict, ingest, process and export paths.
+
+Usage:
+
+    HF_HUB_OFFLINE=1 python -m app.tools.benchmark --output baseline.json
+    HF_HUB_OFFLINE=1 python -m app.tools.benchmark --baseline baseline.json
+
+Runs against the locally cached model and a throwaway SQLite database;
+upload tasks run in process on the in-memory broker. Every case reports
+the median of `--repeat` runs. With `--baseline`, the exit code is 1 if any
+case is more than `--tolerance` slower than in the baseline.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from collections.abc import Awaitable, Callable
+from contextlib import contextmanager
+from datetime import datetime
+
+from app.tools.synthetic import (
+    docx_file,
+    interview_docx_file,
+    lines_file,
+    synthetic_texts,
+    xlsx_file,
+)
+
+xlsx_content_type = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+docx_content_type = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+
+
+def configure_environment(database_url: str | None):
+    # settings and engines are created on import, so the app modules are only
+    # imported once the environment points at the benchmark database
+    os.environ["ENVIRONMENT"] = "pytest"  # selects the in-memory broker
+    os.environ.setdefault("RABBIT_MQ_URL", "amqp://unused")
+    os.environ.setdefault("RABBIT_MQ_QUEUE", "unused")
+    os.environ["DATABASE_URL"] = database_url or (
+        f"sqlite:///{tempfile.mkdtemp(prefix='sentiment-benchmark-')}/benchmark.db"
+    )
+
+
+def measure(run: Callable[[], object], repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+async def measure_async(
+    run: Callable[..., Awaitable[object]],
+    repeat: int,
+    setup: Callable[[], Awaitable[object]] | None = None,
+) -> float:
+    timings = []
+    for _ in range(repeat):
+        # setup isn't timed; its result is passed to `run`
+        args = [await setup()] if setup else []
+        start = time.perf_counter()
+        await run(*args)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+def result(seconds: float, items: int, **extra) -> dict:
+    return {
+        "seconds": seconds,
+        "items": items,
+        "items_per_second": items / seconds if seconds else None,
+        **extra,
+    }
+
+
+def bench_predict(args) -> dict[str, dict]:
+    from app.services.sentiment_predict import SentimentPredict
+
+    predictor = SentimentPredict()
+    predictor.warm_up()
+
+    results = {}
+    for words in args.text_words:
+        texts = synthetic_texts(args.predict_count, words=words, seed=words)
+        for batch_size in args.batch_sizes:
+            seconds = measure(
+                lambda: predictor.predict_batch(texts, batch_size=batch_size), args.repeat
+            )
+            results[f"predict/words={words}/batch={batch_size}"] = result(seconds, len(texts))
+    return results
+
+
+@contextmanager
+def processing_disabled():
+    # ingestion is measured on its own, without the worker scoring the
+    # upload in the same event loop
+    from app.routes import uploads
+
+    kick_upload = uploads.kick_upload
+
+    async def skip(upload_id: int, entries: int):
+        pass
+
+    uploads.kick_upload = skip
+    try:
+        yield
+    finally:
+        uploads.kick_upload = kick_upload
+
+
+async def bench_api(args) -> dict[str, dict]:
+    from httpx import ASGITransport, AsyncClient
+    from sqlmodel import Session, update
+
+    from app.broker import broker, predictor, process_upload
+    from app.dependencies import engine, get_oidc_keycloak_user
+    from app.main import app
+    from app.models.keycloak import KeycloakIDToken
+    from app.models.sentiment import SentimentPredictLevel
+    from app.models.upload import Upload, UploadEntry, UploadStatus
+
+    app.dependency_overrides[get_oidc_keycloak_user] = lambda: KeycloakIDToken(
+        iss="benchmark",
+        sub="benchmark",
+        aud="benchmark",
+        exp=int(time.time()) + 24 * 3600,
+        iat=int(time.time()),
+        email="benchmark@example.com",
+    )
+
+    results = {}
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://benchmark") as client:
+
+        async def upload(name: str, content: bytes, content_type: str, **params) -> int:
+            with processing_disabled():
+                response = await client.post(
+                    "/api/v1/uploads",
+                    files={"file": (name, content, content_type)},
+                    params=params,
+                )
+            response.raise_for_status()
+            return response.json()["id"]
+
+        if "ingest" in args.only:
+            for size in args.sizes:
+                texts = synthetic_texts(size)
+                # the plain formats store the whole file as one entry, their
+                # size is counted in lines or paragraphs
+                files = [
+                    ("lines", "entries", "upload.txt", lines_file(texts), "text/plain", {"format": "lines"}),
+                    ("text", "lines", "upload.txt", lines_file(texts), "text/plain", {}),
+                    ("xlsx", "entries", "upload.xlsx", xlsx_file(texts), xlsx_content_type, {}),
+                    (
+                        "docx",
+                        "entries",
+                        "upload.docx",
+                        interview_docx_file(texts),
+                        docx_content_type,
+                        {"format": "interview-2"},
+                    ),
+                    ("docx-plain", "paragraphs", "upload.docx", docx_file(texts), docx_content_type, {}),
+                ]
+                for kind, unit, name, content, content_type, params in files:
+                    seconds = await measure_async(
+                        lambda: upload(name, content, content_type, **params), args.repeat
+                    )
+                    results[f"ingest/{kind}/{unit}={size}"] = result(
+                        seconds, size, bytes=len(content)
+                    )
+
+        if "process" in args.only:
+
+            async def process(upload_id: int):
+                await process_upload.kiq(upload_id=upload_id)
+                while broker._running_tasks:
+                    await asyncio.gather(*broker._running_tasks)
+
+            # model loading isn't part of any run
+            await asyncio.to_thread(predictor.predictor.warm_up)
+
+            for size in args.process_sizes:
+                upload_ids = []
+
+                async def setup():
+                    # fresh texts every run, so the prediction cache can't
+                    # answer for the model
+                    content = lines_file(synthetic_texts(size, seed=size + len(upload_ids)))
+                    upload_ids.append(
+                        await upload("upload.txt", content, "text/plain", format="lines")
+                    )
+                    return upload_ids[-1]
+
+                seconds = await measure_async(process, args.repeat, setup)
+                with Session(engine) as session:
+                    statuses = {session.get(Upload, id).status for id in upload_ids}
+                if statuses != {UploadStatus.READY}:
+                    raise RuntimeError(f"process_upload left uploads in {statuses}")
+                results[f"process/entries={size}"] = result(seconds, size)
+
+        if "export" in args.only:
+            for size in args.sizes:
+                upload_id = await upload(
+                    "upload.txt", lines_file(synthetic_texts(size)), "text/plain", format="lines"
+                )
+                with Session(engine) as session:
+                    session.exec(
+                        update(UploadEntry)
+                        .where(UploadEntry.upload_id == upload_id)
+                        .values(sentiment=SentimentPredictLevel.NEUTRAL)
+                    )
+                    session.commit()
+
+                for type in ("csv", "xlsx"):
+                    sizes = []
+
+                    async def download():
+                        response = await client.get(
+                            f"/api/v1/uploads/{upload_id}/download", params={"type": type}
+                        )
+                        response.raise_for_status()
+                        sizes.append(len(response.content))
+
+                    seconds = await measure_async(download, args.repeat)
+                    results[f"export/{type}/entries={size}"] = result(
+                        seconds, size, bytes=sizes[-1]
+                    )
+
+    return results
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    """Cases more than `tolerance` slower than the same case in `baseline`."""
+    regressions = []
+    for name, current in results.items():
+        previous = baseline.get("results", {}).get(name)
+        if previous and current["seconds"] > previous["seconds"] * (1 + tolerance):
+            regressions.append(
+                f"{name}: {previous['seconds']:.4f}s -> {current['seconds']:.4f}s"
+            )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--only",
+        nargs="+",
+        default=["predict", "ingest", "process", "export"],
+        choices=["predict", "ingest", "process", "export"],
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--predict-count", type=int, default=256)
+    parser.add_argument("--text-words", type=int, nargs="+", default=[8, 64, 400])
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000])
+    parser.add_argument("--process-sizes", type=int, nargs="+", default=[100, 1000])
+    parser.add_argument("--database-url", help="defaults to a temporary SQLite file")
+    parser.add_argument("--output", help="write the report to this file")
+    parser.add_argument("--baseline", help="report to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    configure_environment(args.database_url)
+    from app.services.sentiment_predict import model_name
+    from app.settings import settings
+
+    results = {}
+    if "predict" in args.only:
+        results.update(bench_predict(args))
+    if {"ingest", "process", "export"} & set(args.only):
+        results.update(asyncio.run(bench_api(args)))
+
+    report = {
+        "meta": {
+            "created_at": datetime.now().isoformat(),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "model": model_name,
+            "inference_backend": settings.inference_backend,
+            "repeat": args.repeat,
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"regression: {regression}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
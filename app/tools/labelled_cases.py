@@ -0,0 +1,15 @@
+"""Texts with the sentiment the model is expected to predict for them."""
+
+from app.models.sentiment import SentimentPredictLevel
+
+labelled_cases = [
+    ("I am very clever", SentimentPredictLevel.VERY_POSITIVE),
+    ("I am dumb", SentimentPredictLevel.VERY_NEGATIVE),
+    ("You job offerring does not look great", SentimentPredictLevel.NEGATIVE),
+    (
+        "My work helped my company to increase revenue by 50%",
+        SentimentPredictLevel.POSITIVE,
+    ),
+    ("I like cats", SentimentPredictLevel.NEUTRAL),
+    ("", SentimentPredictLevel.NEUTRAL),
+]
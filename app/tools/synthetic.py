@@ -0,0 +1,73 @@
+"""
+Synthetic upload data for benchmarks. Everything is generated from a seed,
+so runs with the same arguments score the same texts.
+"""
+
+import io
+import random
+
+import docx
+import openpyxl
+
+vocabulary = {
+    "positive": ["great", "love", "helpful", "fast", "excellent", "friendly", "clear"],
+    "negative": ["slow", "broken", "hate", "confusing", "expensive", "rude", "late"],
+    "neutral": ["product", "team", "delivery", "price", "support", "office", "report"],
+    "filler": ["the", "was", "and", "our", "very", "with", "it", "this", "a", "of"],
+}
+_words = [word for words in vocabulary.values() for word in words]
+
+
+def synthetic_texts(count: int, words: int = 12, seed: int = 0) -> list[str]:
+    """`count` sentences of `words` words drawn from a sentiment-heavy vocabulary."""
+    rng = random.Random(seed)
+    return [
+        " ".join(rng.choice(_words) for _ in range(words)).capitalize() + "."
+        for _ in range(count)
+    ]
+
+
+def lines_file(texts: list[str]) -> bytes:
+    """A text file with one entry per line, for the `lines` format."""
+    return "".join(f"{text}\n" for text in texts).encode()
+
+
+def xlsx_file(texts: list[str]) -> bytes:
+    """A workbook with one entry per row in the first column."""
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    for text in texts:
+        sheet.append([text])
+
+    file = io.BytesIO()
+    workbook.save(file)
+    return file.getvalue()
+
+
+def docx_file(texts: list[str]) -> bytes:
+    """A document with one paragraph per text, read as a single entry."""
+    document = docx.Document()
+    for text in texts:
+        document.add_paragraph(text)
+
+    file = io.BytesIO()
+    document.save(file)
+    return file.getvalue()
+
+
+def interview_docx_file(texts: list[str]) -> bytes:
+    """An `interview-2` document with one numbered question per answer."""
+    document = docx.Document()
+    for paragraph in [
+        "Synthetic interview",
+        "Респондент: Benchmark",
+        "Дата интервью: 01/10/2024",
+    ]:
+        document.add_paragraph(paragraph)
+    for i, text in enumerate(texts, 1):
+        document.add_paragraph(f"{i}. What do you think about item {i}?")
+        document.add_paragraph(text)
+
+    file = io.BytesIO()
+    document.save(file)
+    return file.getvalue()